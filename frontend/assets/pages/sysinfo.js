@@ -2,11 +2,12 @@
 import { PageManager, Toast } from '../app.js';
 
 // --- 配置 ---
-const WS_URL = (location.protocol === 'https:' ? 'wss://' : 'ws://') + location.host + location.pathname.substring(0, location.pathname.lastIndexOf('/') + 1) + 'sysinfo/ws/';
+const WS_URL = (location.protocol === 'https:' ? 'wss://' : 'ws://') + location.host + location.pathname.substring(0, location.pathname.lastIndexOf('/') + 1) + 'sysinfo/ws/?mode=delta';
 
 // --- 状态管理 ---
 let ws = null;
 let lastData = {}; // 用于计算速率
+let snapshot = {}; // delta 模式下合并后的完整数据
 let domCache = {}; // DOM 缓存
 
 // --- Page Hook ---
@@ -100,6 +101,7 @@ function renderLayout() {
                             <span class="text-secondary">当前进程数</span>
                             <span class="fw-bold"><span id="proc-count">-</span> <span class="small fw-normal text-muted">个</span></span>
                         </div>
+                        <div class="d-flex flex-wrap gap-1 mt-2" id="cpu-core-bars"></div>
                     </div>
                 </div>
             </div>
@@ -244,6 +246,7 @@ function renderLayout() {
                             <span class="text-secondary">错误 / 丢包</span>
                             <span class="fw-bold" id="net-errors">0</span>
                         </div>
+                        <div id="nic-list"></div>
                     </div>
                 </div>
             </div>
@@ -293,6 +296,7 @@ function renderLayout() {
                                     总读取: <span id="disk-read-total">-</span> | 总写入: <span id="disk-write-total">-</span>
                                 </div>
                             </div>
+                            <div class="col-12" id="disk-list"></div>
                         </div>
                     </div>
                 </div>
@@ -309,7 +313,7 @@ function initCache() {
     const ids = [
         'node-name', 'os-platform', 'ws-status',
         // CPU
-        'cpu-circle', 'cpu-val-center', 'cpu-val-big', 'cpu-model', 'cpu-cores', 'cpu-threads', 'cpu-freq', 'proc-count',
+        'cpu-circle', 'cpu-val-center', 'cpu-val-big', 'cpu-model', 'cpu-cores', 'cpu-threads', 'cpu-freq', 'proc-count', 'cpu-core-bars',
         // Memory & Swap
         'mem-circle', 'mem-val-center', 'mem-text', 'mem-bar',
         'swap-text', 'swap-bar',
@@ -318,11 +322,11 @@ function initCache() {
         'os-detail', 'os-arch', 'uptime', 'boot-time-str', 'server-time', 'time-zone',
         // Network
         'net-rx-speed', 'net-tx-speed', 'net-rx-pps', 'net-tx-pps', 
-        'net-rx-total', 'net-tx-total', 'ip-addr', 'tcp4-count', 'tcp6-count', 'net-errors',
+        'net-rx-total', 'net-tx-total', 'ip-addr', 'tcp4-count', 'tcp6-count', 'net-errors', 'nic-list',
         // Disk
         'disk-percent-text', 'disk-bar', 'disk-used', 'disk-total', 
         'disk-read-speed', 'disk-write-speed', 'disk-read-iops', 'disk-write-iops',
-        'disk-read-total', 'disk-write-total'
+        'disk-read-total', 'disk-write-total', 'disk-list'
     ];
     ids.forEach(id => domCache[id] = document.getElementById(id));
 }
@@ -330,6 +334,7 @@ function initCache() {
 function connectWebSocket() {
     if (ws) ws.close();
     updateStatus('连接中...', 'bg-warning text-dark');
+    snapshot = {};
     ws = new WebSocket(WS_URL);
     ws.onopen = () => updateStatus('实时监控', 'bg-success');
     ws.onclose = () => {
@@ -339,7 +344,8 @@ function connectWebSocket() {
     ws.onerror = () => updateStatus('连接错误', 'bg-danger');
     ws.onmessage = (event) => {
         try {
-            updateDashboard(JSON.parse(event.data));
+            snapshot = mergeFrame(snapshot, JSON.parse(event.data));
+            updateDashboard(snapshot);
         } catch (e) {
             console.error('Data Error', e);
         }
@@ -370,6 +376,13 @@ function updateDashboard(data) {
     setText('cpu-threads', data.cpu_threads); // 逻辑核心数
     setText('cpu-freq', (data.cpu_freq || 0).toFixed(0) + ' MHz');
     setText('proc-count', data.process_count);
+    if (domCache['cpu-core-bars'] && data.cpu_per_core) {
+        domCache['cpu-core-bars'].innerHTML = data.cpu_per_core.map((pct, i) => `
+            <div class="flex-fill" style="min-width: 40px;" title="CPU ${i}: ${pct.toFixed(1)}%">
+                <div class="progress progress-slim"><div class="progress-bar" style="width: ${pct}%"></div></div>
+                <div class="mini-stat-sub text-center">${i}</div>
+            </div>`).join('');
+    }
 
     // 3. Memory
     const mem = data.memory || {};
@@ -405,11 +418,14 @@ function updateDashboard(data) {
     setText('time-zone', data.time_zone);
 
     // 6. Network
+    const times = data.sample_times || {};
     const net = data.network || {};
-    const rxRate = calcDelta('rx_bytes', net.bytes_recv);
-    const txRate = calcDelta('tx_bytes', net.bytes_sent);
-    const rxPps = calcDelta('rx_pkts', net.packets_recv);
-    const txPps = calcDelta('tx_pkts', net.packets_sent);
+    // 优先使用服务端计算好的速率，兼容旧版服务端时在浏览器中差分
+    const netRate = data.network_rate;
+    const rxRate = netRate ? netRate.rx_bytes_per_sec : calcDelta('rx_bytes', net.bytes_recv, times.network);
+    const txRate = netRate ? netRate.tx_bytes_per_sec : calcDelta('tx_bytes', net.bytes_sent, times.network);
+    const rxPps = netRate ? netRate.rx_packets_per_sec : calcDelta('rx_pkts', net.packets_recv, times.network);
+    const txPps = netRate ? netRate.tx_packets_per_sec : calcDelta('tx_pkts', net.packets_sent, times.network);
     const totalErrors = (net.errin || 0) + (net.errout || 0) + (net.dropin || 0) + (net.dropout || 0);
 
     setText('net-rx-speed', formatBytes(rxRate) + '/s');
@@ -436,10 +452,11 @@ function updateDashboard(data) {
     setText('disk-used', formatBytes(dsk.used));
     setText('disk-total', formatBytes(dsk.total));
 
-    const rRate = calcDelta('d_r_b', dskIo.read_bytes);
-    const wRate = calcDelta('d_w_b', dskIo.write_bytes);
-    const rIops = calcDelta('d_r_c', dskIo.read_count);
-    const wIops = calcDelta('d_w_c', dskIo.write_count);
+    const dskRate = data.disk_io_rate;
+    const rRate = dskRate ? dskRate.read_bytes_per_sec : calcDelta('d_r_b', dskIo.read_bytes, times.disk);
+    const wRate = dskRate ? dskRate.write_bytes_per_sec : calcDelta('d_w_b', dskIo.write_bytes, times.disk);
+    const rIops = dskRate ? dskRate.read_iops : calcDelta('d_r_c', dskIo.read_count, times.disk);
+    const wIops = dskRate ? dskRate.write_iops : calcDelta('d_w_c', dskIo.write_count, times.disk);
 
     setText('disk-read-speed', formatBytes(rRate) + '/s');
     setText('disk-write-speed', formatBytes(wRate) + '/s');
@@ -447,23 +464,60 @@ function updateDashboard(data) {
     setText('disk-write-iops', formatNum(wIops) + ' IOPS');
     setText('disk-read-total', formatBytes(dskIo.read_bytes));
     setText('disk-write-total', formatBytes(dskIo.write_bytes));
+
+    // 8. 各网卡 / 各磁盘速率
+    if (domCache['nic-list'] && data.nics) {
+        domCache['nic-list'].innerHTML = Object.entries(data.nics).map(([name, r]) => `
+            <div class="detail-item">
+                <span class="text-secondary">${name}</span>
+                <span class="fw-bold">
+                    <span class="text-success"><i class="fas fa-arrow-down"></i> ${formatBytes(r.rx_bytes_per_sec)}/s</span> &nbsp;
+                    <span class="text-info"><i class="fas fa-arrow-up"></i> ${formatBytes(r.tx_bytes_per_sec)}/s</span>
+                </span>
+            </div>`).join('');
+    }
+    if (domCache['disk-list'] && data.disks) {
+        domCache['disk-list'].innerHTML = Object.entries(data.disks).map(([name, r]) => `
+            <div class="detail-item">
+                <span class="text-secondary">${name}</span>
+                <span class="fw-bold">
+                    读 ${formatBytes(r.read_bytes_per_sec)}/s (${formatNum(r.read_iops)} IOPS) &nbsp;
+                    写 ${formatBytes(r.write_bytes_per_sec)}/s (${formatNum(r.write_iops)} IOPS) &nbsp;
+                    <span class="text-muted">繁忙 ${r.busy_percent}%</span>
+                </span>
+            </div>`).join('');
+    }
 }
 
 // --- 工具函数 ---
 
+// 将 delta 帧合并进快照 (嵌套对象递归合并，null 表示字段被删除)
+function mergeFrame(target, delta) {
+    for (const [key, value] of Object.entries(delta)) {
+        if (value === null) delete target[key];
+        else if (typeof value === 'object' && !Array.isArray(value) && typeof target[key] === 'object' && target[key] !== null && !Array.isArray(target[key])) mergeFrame(target[key], value);
+        else target[key] = value;
+    }
+    return target;
+}
+
 function setText(id, val) {
     if (domCache[id]) domCache[id].textContent = (val !== undefined && val !== null) ? val : '-';
 }
 
-function calcDelta(key, currentVal) {
+function calcDelta(key, currentVal, sampleTime) {
     if (currentVal === undefined || currentVal === null) return 0;
-    const lastVal = lastData[key]; 
-    lastData[key] = currentVal;
-    
-    if (lastVal === undefined) return 0; 
-    let delta = currentVal - lastVal;
-    if (delta < 0) delta = 0; 
-    return delta;
+    const last = lastData[key];
+    // 服务端按分组间隔刷新，同一次采样的值沿用上次算出的速率
+    if (last && sampleTime !== undefined && last.time === sampleTime) return last.rate;
+
+    let rate = 0;
+    if (last !== undefined) {
+        const elapsed = (sampleTime !== undefined && last.time !== undefined) ? sampleTime - last.time : 1;
+        rate = Math.max(0, currentVal - last.val) / (elapsed > 0 ? elapsed : 1);
+    }
+    lastData[key] = { val: currentVal, time: sampleTime, rate };
+    return rate;
 }
 
 function formatBytes(bytes) {
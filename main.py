@@ -1,4 +1,9 @@
 
+# 必须在导入其它模块之前打补丁: service_manager 导入时就会启动服务和回收线程，
+# 之后 sysinfo 再调用 patch_all() 会替换掉已在使用的 threading 锁，导致 "cannot release un-acquired lock"
+from gevent import monkey
+monkey.patch_all()
+
 import os, io
 from traceback import format_exc
 from bottle import Bottle, request, response, template, static_file, redirect, abort
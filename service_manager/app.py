@@ -1,8 +1,10 @@
+import codecs
 import locale
 from pathlib import Path
 import re
 import sys, os, datetime, time, platform, subprocess, json
 import math
+import inspect
 import atexit
 from types import SimpleNamespace
 from bottle import Bottle, request, response, template, static_file, redirect, abort, Response, url
@@ -11,6 +13,26 @@ import signal
 import fire, psutil
 
 import threading
+from collections import deque
+
+try:
+    from . import cgroups
+    from .reaper import reaper
+    from .scheduler import scheduler
+    from .logstore import ServiceLog, pump
+    from . import logsearch
+    from .proctable import process_table, terminate_processes, SORT_KEYS
+    from .configwatch import ConfigWatcher
+    from .registry import ServiceRegistry
+except ImportError: # 直接运行 app.py 时
+    import cgroups
+    from reaper import reaper
+    from scheduler import scheduler
+    from logstore import ServiceLog, pump
+    import logsearch
+    from proctable import process_table, terminate_processes, SORT_KEYS
+    from configwatch import ConfigWatcher
+    from registry import ServiceRegistry
 
 import tracemalloc
 tracemalloc.start()
@@ -22,33 +44,105 @@ app = Bottle()
 config_dir = (Path(script_dir) / 'services').as_posix() + '/'
 log_dir = (Path(script_dir) / 'logs').as_posix() + '/'
 services = {}
+RESTART_POLICIES = ('never', 'on-failure', 'always')
+RESTART_OPTIONS = ('restart', 'restart_delay', 'restart_delay_max', 'crash_loop_threshold', 'crash_loop_window')
+SERVICE_CONCURRENCY = int(os.environ.get('SERVICE_CONCURRENCY', 8)) # 批量启动/停止服务时同时处理的服务数
+REGISTRY_PATH = os.environ.get('SERVICE_REGISTRY_PATH') or os.path.join(script_dir, 'data', 'registry.db')
+registry = ServiceRegistry(REGISTRY_PATH)
+
+
+def read_config(file_path) -> dict:
+    with open(file_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
 
+def validate_config(name, config):
+    '''
+    检查服务配置，不合法时抛出 ValueError
+    不创建服务对象，覆盖 Service、configure_restart 和 ServiceLog.configure 的所有参数，通过检查的配置加载时不会出错
+    '''
+    if not isinstance(config, dict):
+        raise ValueError(f"{name}: config must be an object")
+    parameters = inspect.signature(Service).parameters
+    unknown = set(config) - set(parameters) - set(RESTART_OPTIONS)
+    if unknown:
+        raise ValueError(f"{name}: unknown options: {', '.join(sorted(unknown))}")
+    try:
+        inspect.signature(Service).bind(name=name, **config)
+    except TypeError as e:
+        raise ValueError(f"{name}: {e}")
+    if not isinstance(config["cmd"], str):
+        raise ValueError(f"{name}: cmd must be a string")
+    if config["cwd"] is not None and not isinstance(config["cwd"], str):
+        raise ValueError(f"{name}: cwd must be a string")
+    env = config["env"]
+    if env is not None and not (isinstance(env, dict) and all(isinstance(value, str) for value in env.values())):
+        raise ValueError(f"{name}: env must be an object of strings")
+    if not isinstance(config["is_enabled"], (int, bool)):
+        raise ValueError(f"{name}: is_enabled must be 0/1 or a boolean")
+    if not isinstance(config.get("cgroup", True), (bool, str)):
+        raise ValueError(f"{name}: cgroup must be a boolean or a cgroup path")
+    depends_on = config.get("depends_on") or []
+    if not (isinstance(depends_on, list) and all(isinstance(dependency, str) for dependency in depends_on)):
+        raise ValueError(f"{name}: depends_on must be a list of service names")
 
-def monitor_process(proc, cleanup_fn):
-    proc.wait() # 阻塞等待进程结束
-    print(f"Process PID: {proc.pid} has exited with return code: {proc.returncode}")
-    cleanup_fn()
+    if config.get('restart', 'never') not in RESTART_POLICIES:
+        raise ValueError(f"{name}: unknown restart policy: {config['restart']}")
+    for key in RESTART_OPTIONS[1:]:
+        if key in config and not _is_number(config[key]):
+            raise ValueError(f"{name}: {key} must be a non-negative number")
+    if isinstance(config.get('crash_loop_threshold'), float):
+        raise ValueError(f"{name}: crash_loop_threshold must be an integer")
 
-def init_service(file_path, name, always_start=False):
+    log = config.get("log") or {}
+    if not isinstance(log, dict):
+        raise ValueError(f"{name}: log must be an object")
+    log_options = set(inspect.signature(ServiceLog.configure).parameters) - {'self'}
+    unknown = set(log) - log_options
+    if unknown:
+        raise ValueError(f"{name}: unknown log options: {', '.join(sorted(unknown))}")
+    for key, value in log.items():
+        if not _is_number(value):
+            raise ValueError(f"{name}: log.{key} must be a non-negative number")
+
+def init_service(file_path, name, always_start=False, start=True, config=None, sync=True):
     '''
     根据服务的配置文件创建/更新服务对象并启动服务。
-    服务从未启动过才启动, 不启动已经停止的服务
+    服务从未启动过才启动, 不启动已经停止的服务; start=False 时只创建/更新服务对象
+    config: 已经读取的配置; sync=False 时由调用方在一个事务中批量写入注册表
     '''
-    with open(file_path, "r", encoding="utf-8") as f:
-        config = json.load(f)
+    if config is None:
+        config = read_config(file_path)
     
+
     if name in services:
         service = services[name]
-        service.cmd = config["cmd"]
+        # 先算出并检查全部新设置再赋值，配置有误时服务保持原来的设置，不会只更新了一半
+        cmd, is_enabled = config["cmd"], config["is_enabled"]
+        env = os.environ.copy()
+        env.update(config.get("env") or {})
+        restart_options = {key: config[key] for key in RESTART_OPTIONS if key in config}
+        if restart_options.get('restart', 'never') not in RESTART_POLICIES:
+            raise ValueError(f"Unknown restart policy: {restart_options['restart']}")
+        log_options = config.get("log") or {}
+        inspect.signature(service.log.configure).bind(**log_options)
+        service.cmd = cmd
         service.cwd = config.get("cwd") or os.path.expanduser('~')
-        service.env = os.environ.copy()
-        service.env.update(config.get("env", {}))
-        service.is_enabled = config["is_enabled"]
+        service.env = env
+        service.is_enabled = is_enabled
+        service.cgroup = config.get("cgroup", True)
+        service.depends_on = config.get("depends_on") or []
+        service.configure_restart(**restart_options)
+        service.log.configure(**log_options)
     else:
         service = Service(name=name, **config)
         services[name] = service
+    if sync:
+        registry.sync({name: config})
 
-    if service.is_enabled and (not service.process or always_start):
+    if start and service.is_enabled and (not service.process or always_start):
         try:
             pid = service.start()
             msg = f"{service.name} Started with pid: {str(pid)}"
@@ -57,19 +151,178 @@ def init_service(file_path, name, always_start=False):
         print(msg)
         return msg
 
+def remove_service(name):
+    '''停止并移除服务，先停止再从注册表中删除'''
+    service = services.get(name)
+    if service is None:
+        return
+    service.stop()
+    services.pop(name, None)
+    registry.sync({}, [name])
+    pump.forget(service.log)
+    if service.cgroup is True and service.cgroup_path:
+        cgroups.remove(service.cgroup_path)
+
+def start_new_services(names):
+    '''从未启动过的已启用服务按依赖顺序分批并行启动'''
+    names = [name for name in names if services[name].is_enabled and not services[name].process]
+    try:
+        results = start_services(names)
+    except ValueError as e:
+        print(f"{e}, starting services without dependency order")
+        results = run_in_waves([names], start_service)
+    for msg in results.values():
+        print(msg)
+
 def load_configs():
-    configs = [
-        {"file_path": file_path, "stat": stat, "name": name, "filename": filename}
-        for filename in os.listdir(config_dir) 
-        if (
-            os.path.isfile(file_path := os.path.join(config_dir, filename)) 
-            and (stat := os.stat(file_path)) 
-            and (name := os.path.splitext(os.path.basename(filename))[0])
-        )
-    ]
-    print(f"Found {len(configs)} service configurations.\n\n")
-    for config in configs:
-        init_service(file_path=config["file_path"], name=config["name"])
+    snapshot = config_watcher.scan()
+    print(f"Found {len(snapshot)} service configurations.\n\n")
+    configs = {}
+    for filename in snapshot:
+        name = os.path.splitext(filename)[0]
+        configs[name] = config = read_config(os.path.join(config_dir, filename))
+        init_service(file_path=os.path.join(config_dir, filename), name=name, start=False, config=config, sync=False)
+    # 注册表按配置目录全量同步，上次运行留下的状态作废，退出历史保留
+    registry.sync(configs, replace=True)
+    registry.reset_states()
+    names = list(configs)
+    config_watcher.mark_applied(snapshot)
+    start_new_services(names)
+    config_watcher.start() # 之后只重新加载有变化的配置文件
+
+def apply_config_changes(added, changed, removed):
+    '''
+    配置目录变化时调用: 只解析新增和修改的配置文件，删除了配置文件的服务停止并移除
+    这一批变化在一个事务中写入注册表，返回加载失败的文件 {文件名: 错误}
+    '''
+    removed_names = [os.path.splitext(filename)[0] for filename in removed]
+    for name in removed_names:
+        if name in services:
+            print(f"Config {name}.json removed, removing service {name}")
+            remove_service(name)
+    configs = {}
+    failed = {}
+    for filename in added + changed:
+        name = os.path.splitext(filename)[0]
+        try:
+            config = read_config(os.path.join(config_dir, filename))
+            validate_config(name, config)
+            init_service(file_path=os.path.join(config_dir, filename), name=name, start=False, config=config,
+                         sync=False)
+            configs[name] = config
+            print(f"Config {filename} {'added' if filename in added else 'changed'}")
+        except (OSError, ValueError, KeyError, TypeError) as e: # 编辑中的文件可能暂时不是合法的配置
+            print(f"Failed to load config {filename}: {e}")
+            failed[filename] = str(e)
+    registry.sync(configs, removed_names)
+    start_new_services(list(configs))
+    return failed
+
+config_watcher = ConfigWatcher(config_dir, apply_config_changes)
+
+def dependency_waves(names, reverse=False) -> list[list[str]]:
+    '''
+    按 depends_on 把服务分成若干批，同一批内的服务互不依赖，可以并行处理。
+    启动时被依赖的服务在前，停止时 (reverse=True) 依赖它的服务在前。只考虑 names 之间的依赖关系
+    '''
+    names = list(dict.fromkeys(names))
+    dependents = {name: [] for name in names}
+    pending = {} # 尚未处理的依赖数
+    for name in names:
+        deps = {dep for dep in services[name].depends_on if dep in dependents and dep != name}
+        pending[name] = len(deps)
+        for dep in deps:
+            dependents[dep].append(name)
+
+    waves = []
+    wave = [name for name in names if not pending[name]]
+    while wave:
+        waves.append(wave)
+        next_wave = []
+        for name in wave:
+            for dependent in dependents[name]:
+                pending[dependent] -= 1
+                if not pending[dependent]:
+                    next_wave.append(dependent)
+        wave = next_wave
+
+    if sum(map(len, waves)) < len(names):
+        raise ValueError(f"Circular dependency among services: {', '.join(n for n in names if pending[n])}")
+    return waves[::-1] if reverse else waves
+
+def run_in_waves(waves, action, concurrency=None) -> dict:
+    '''逐批执行，每批内最多 concurrency 个服务并行调用 action(name)，返回 {name: 结果}'''
+    # 不用 ThreadPoolExecutor: 解释器退出时 (on_exit) 它已不接受新任务
+    results = {}
+    lock = threading.Lock()
+    for wave in waves:
+        pending = iter(wave)
+
+        def worker():
+            while True:
+                with lock:
+                    name = next(pending, None)
+                if name is None:
+                    return
+                result = action(name)
+                with lock:
+                    results[name] = result
+
+        workers = [threading.Thread(target=worker, daemon=True)
+                   for _ in range(min(concurrency or SERVICE_CONCURRENCY, len(wave)))]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    # 按批次顺序返回
+    return {name: results[name] for wave in waves for name in wave}
+
+def start_service(name) -> str:
+    service = services[name]
+    try:
+        pid = service.start()
+        return f"{service.name} Started with pid: {str(pid)}"
+    except RuntimeError as e:
+        return f"{service.name} Service failed: {str(e)}"
+
+def start_services(names, concurrency=None) -> dict:
+    '''
+    按依赖顺序分批并行启动服务，未运行的依赖会一并启动；
+    依赖启动失败时跳过依赖它的服务。存在循环依赖时抛出 ValueError
+    '''
+    names = list(names)
+    queue = list(names)
+    while queue: # 补上未运行的依赖
+        for dep in services[queue.pop()].depends_on:
+            if dep not in services:
+                print(f"Unknown dependency: {dep}")
+            elif dep not in names and not services[dep].is_running():
+                names.append(dep)
+                queue.append(dep)
+
+    failed = set()
+    def start_one(name):
+        if services[name].is_running():
+            return f"{name} Service is already running"
+        broken = [dep for dep in services[name].depends_on if dep in failed]
+        if broken:
+            failed.add(name)
+            return f"{name} Service skipped: dependency {', '.join(broken)} failed to start"
+        msg = start_service(name)
+        if not services[name].is_running():
+            failed.add(name)
+        return msg
+
+    return run_in_waves(dependency_waves(names), start_one, concurrency)
+
+def stop_services(names, concurrency=None) -> dict:
+    '''按依赖的反序分批并行停止服务，先停依赖方再停被依赖的服务'''
+    try:
+        waves = dependency_waves(names, reverse=True)
+    except ValueError as e:
+        print(f"{e}, stopping services without dependency order")
+        waves = [list(names)]
+    return run_in_waves(waves, lambda name: services[name].stop(), concurrency)
 
 def format_bytes(bytes):
     sizes = ['Bytes', 'KB', 'MB', 'GB', 'TB']
@@ -87,32 +340,24 @@ def format_bytes(bytes):
     return f"{formatted_size:.2f} {sizes[i]}"
 
 def find_process_by_command(command) -> list[int]:
-    pid_list = []
-    if platform.system() == 'Windows':
-        completed_process = subprocess.run(['powershell', '-Command', "Get-WmiObject Win32_Process | Where-Object { $_.CommandLine -like '*" + command + "*' } | Select-Object -ExpandProperty ProcessId"], capture_output=True, text=True)
-    elif platform.system() == 'Linux':
-        completed_process = subprocess.run(['pgrep', '-f', command], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) # requires procps package
-    if completed_process.returncode == 0 and completed_process.stdout:
-        pid_list = list(map(int, completed_process.stdout.strip().split('\n')))
-    return pid_list
-
-def terminate_process_by_pid(pid):
-    if platform.system() == 'Windows':
-        command = f'taskkill /F /PID {pid}'
-    elif platform.system() == 'Linux':
-        command = f'kill -9 {pid}'
-    try:
-        output = subprocess.run(command, shell=True, check=True, capture_output=True, text=True)
-        return output.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        return f"Error: {e.stderr.strip()}"
+    # 在缓存的进程表中按命令行子串搜索 (不区分大小写)，不再启动 pgrep / PowerShell
+    return process_table.search(command)
 
 def split_with_quotes(string, sep='/'):
     parts = re.findall(r'(?:".*?"|[^' + sep + r'"]+)', string)
     return [part.strip('"') for part in parts]
 
+def describe_status(state, pid, exit_code, next_restart_at) -> str:
+    if state == 'running':
+        return f'running, pid: {pid}'
+    if state == 'restarting':
+        return f'restarting in {max((next_restart_at or 0) - time.time(), 0):.0f}s, return code: {exit_code}'
+    if state in ('crash loop', 'stopped'):
+        return f'{state}, return code: {exit_code}'
+    return state
+
 class Service:
-    def __init__(self, name, cmd, cwd, env, is_enabled):
+    def __init__(self, name, cmd, cwd, env, is_enabled, cgroup=True, depends_on=None, log=None, **restart_options):
         self.name = name
         self.cmd = cmd
         self.cwd = cwd or os.path.expanduser('~')
@@ -122,49 +367,151 @@ class Service:
             self.env.update(env)
 
         self.is_enabled = is_enabled
+        # cgroup: true 为服务创建单独的 cgroup; false 不使用; 字符串为已有 cgroup 的路径 (相对 cgroup2 挂载点)，只读取统计
+        self.cgroup = cgroup
+        self.cgroup_path = None
+        self.depends_on = depends_on or [] # 依赖的服务名，批量启动时先启动依赖，停止时后停止
+        # log: 日志轮转和保留策略 {"max_size": 字节, "max_age": 秒, "max_segments": 个数, "retention": 秒}
+        self.log = ServiceLog(log_dir, name, **(log or {}))
         self.process = None
+        self.started_at = None
+        self.exit_code = None # 最近一次退出的返回码
+        self.exited_at = None # 最近一次退出的时间戳
+
+        self.configure_restart(**restart_options)
+        self.restart_count = 0 # 自动重启的总次数
+        self.crash_loop = False # 短时间内重启太多次，已放弃自动重启
+        self.next_restart_at = None
+        self._failures = 0 # 连续失败次数，决定退避时间
+        self._restart_times = deque() # crash_loop_window 内自动重启的时间
+        self._restart_timer = None
+        self._stopping = False # 手动停止的服务退出后不自动重启
+
+    def configure_restart(self, restart='never', restart_delay=1, restart_delay_max=60,
+                          crash_loop_threshold=5, crash_loop_window=60):
+        '''
+        restart: 进程退出后是否自动重启, never / on-failure (返回码非 0 时) / always
+        restart_delay / restart_delay_max: 重启前等待的秒数，每次连续失败翻倍，直到最大值
+        crash_loop_threshold / crash_loop_window: crash_loop_window 秒内自动重启达到该次数时放弃重启；
+        服务稳定运行超过 crash_loop_window 秒后退避时间重新计算
+        '''
+        if restart not in RESTART_POLICIES:
+            raise ValueError(f"Unknown restart policy: {restart}")
+        self.restart_policy = restart # 配置项叫 restart，属性不能同名，否则会覆盖 restart() 方法
+        self.restart_delay = restart_delay
+        self.restart_delay_max = restart_delay_max
+        self.crash_loop_threshold = crash_loop_threshold
+        self.crash_loop_window = crash_loop_window
+
+    def _create_cgroup(self) -> str | None:
+        '''创建服务自己的 cgroup 并返回其路径，进程启动后由 _attach_cgroup 移入'''
+        self.cgroup_path = None
+        if platform.system() != 'Linux' or self.cgroup is False:
+            return None
+        if isinstance(self.cgroup, str):
+            root = cgroups.mount_point()
+            if root:
+                self.cgroup_path = os.path.join(root, self.cgroup.lstrip('/'))
+            return None
+        return cgroups.create(self.name)
 
-    def start(self) -> int:
-        if self.process and self.process.poll() is None:
+    def _attach_cgroup(self, path):
+        '''
+        在父进程中把刚启动的服务进程移入 cgroup。
+        不用 preexec_fn 在子进程中移入: 本进程有多个线程，fork 之后到 exec 之前运行 Python 代码可能死锁。
+        代价是一个很短的窗口: Popen 返回 (子进程已经 exec) 到写入 cgroup.procs 之前服务 fork 出的子进程
+        留在原来的 cgroup 中，不计入服务的统计
+        '''
+        if path is None:
+            return
+        try:
+            cgroups.attach(path, self.process.pid)
+        except OSError:
+            pass # 没有权限或进程已经退出时仍然正常启动，只是没有单独的 cgroup
+
+    def _discover_cgroup(self):
+        '''启动后确认服务实际所在的 cgroup，与本进程相同时不算作服务自己的 cgroup'''
+        if self.cgroup_path or platform.system() != 'Linux' or self.cgroup is False:
+            return
+        path = cgroups.process_cgroup(self.process.pid)
+        if path and path != cgroups.process_cgroup(os.getpid()):
+            self.cgroup_path = path
+
+    def cgroup_stats(self) -> dict | None:
+        return cgroups.read_stats(self.cgroup_path)
+
+    def is_running(self) -> bool:
+        return bool(self.process and self.process.poll() is None)
+
+    def start(self, auto=False) -> int:
+        if self.is_running():
             raise RuntimeError(f"Service '{self.name}' is already running")
+        if not auto: # 手动启动时重置自动重启的状态
+            self._cancel_restart()
+            self._failures = 0
+            self._restart_times.clear()
+            self.crash_loop = False
+        self._stopping = False
 
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
+        # 输出写入管道，由 LogPump 读取后写入日志，以便按大小/时间轮转
+        output_r, output_w = os.pipe()
         try:
-            self.log_file = open(f'{log_dir}{self.name}.log', 'ab')
+            cgroup = self._create_cgroup()
             cmd_splits = split_with_quotes(self.cmd, sep=' ')
             # print(f"Starting service {self.name} with command:", cmd_splits, "in cwd:", self.cwd)
-            self.process = subprocess.Popen(
-                args=cmd_splits, cwd=self.cwd or os.getcwd(),
-                stdin=subprocess.PIPE, stdout=self.log_file, stderr=self.log_file, # 运行python脚本时必须在其代码顶部加上sys.stdout.reconfigure(line_buffering=True) 或者用python.exe -u运行才能实时输出日志
-                env=self.env, # win下传空字典会报winerror87
-                shell=False, # shell=True，它会让系统用 shell 去解析命令，比如：Windows 下：cmd.exe /c "python my_script.py --arg value"  Linux/Mac 下：/bin/sh -c "python my_script.py --arg value"
-                text=True, encoding='utf-8', errors='ignore',
-            )
+            try:
+                self.process = subprocess.Popen(
+                    args=cmd_splits, cwd=self.cwd or os.getcwd(),
+                    stdin=subprocess.PIPE, stdout=output_w, stderr=output_w, # 运行python脚本时必须在其代码顶部加上sys.stdout.reconfigure(line_buffering=True) 或者用python.exe -u运行才能实时输出日志
+                    env=self.env, # win下传空字典会报winerror87
+                    shell=False, # shell=True，它会让系统用 shell 去解析命令，比如：Windows 下：cmd.exe /c "python my_script.py --arg value"  Linux/Mac 下：/bin/sh -c "python my_script.py --arg value"
+                    text=True, encoding='utf-8', errors='ignore',
+                )
+            except Exception:
+                os.close(output_r)
+                raise
+            finally:
+                os.close(output_w)
+            self._attach_cgroup(cgroup)
+            pump.attach(output_r, self.log)
+            self.started_at = time.time()
+            self._discover_cgroup()
             
-            # 后台线程监控进程退出，清理资源
-            threading.Thread(target=monitor_process, args=(self.process, self.clean_up), daemon=True).start()
+            self._record_state()
+            # 由统一的回收线程等待进程退出，清理资源
+            reaper.watch(self.process, self.on_process_exit)
         except Exception as e:                
             raise RuntimeError(f"{str(e)}")
         return self.process.pid
 
     def stop(self):
-        if not (self.process and self.process.poll() is None):
+        self._stopping = True
+        if self._cancel_restart():
+            self._record_state()
+            return self.name + ' pending restart cancelled'
+        if not self.is_running():
             return self.name + ' not running'
 
         try:
-            # 终止进程
+            # 先记下整个进程树: 服务进程退出后它的子进程会被挂到 init 下，就找不到了
+            children = process_table.subtree(self.process.pid, fresh=True)[1:]
+
+            # 终止进程及其子孙进程，子孙进程和服务进程共用同一个 5 秒的期限
+            deadline = time.monotonic() + 5
             self.process.terminate()
             # os.kill(self.process.pid, signal.SIGTERM) # 15
+            for pid, result in terminate_processes(children, timeout=5).items():
+                if result == 'killed':
+                    print(f"Child process PID: {pid} of {self.name} did not exit within 5 seconds, killed")
             
             # 等待进程结束（或者可以执行其他任务，不必等待）
-            returncode = self.process.wait(timeout=5)
-            
-        except subprocess.TimeoutExpired:
-            print(f"Process PID: {self.process.pid} has not exited within 5 seconds, terminating it forcefully...")
-            # 强制终止进程
-            self.process.kill()
-            # os.kill(self.process.pid, signal.SIGKILL) # 9
+            try:
+                returncode = self.process.wait(timeout=max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                print(f"Process PID: {self.process.pid} has not exited within 5 seconds, terminating it forcefully...")
+                # 强制终止进程
+                self.process.kill()
+                # os.kill(self.process.pid, signal.SIGKILL) # 9
         finally:
             # 清理资源
             self.clean_up()
@@ -173,19 +520,93 @@ class Service:
         self.stop()
         return self.start()
 
-    def status(self) -> str:
-        if self.process:
-            if self.process.poll() is None:
-                return 'running, pid: {}'.format(self.process.pid)
-            else:
-                return f'stopped, return code: {self.process.returncode}'
-        else:
+    def state(self) -> str:
+        if not self.process:
             return 'not started'
+        if self.process.poll() is None:
+            return 'running'
+        if self.next_restart_at:
+            return 'restarting'
+        if self.crash_loop:
+            return 'crash loop'
+        return 'stopped'
+
+    def status(self) -> str:
+        return describe_status(self.state(), self.process and self.process.pid,
+                               self.process and self.process.returncode, self.next_restart_at)
+
+    def _registered(self) -> bool:
+        '''已被移除或替换的服务对象不再写注册表 (进程可能在移除后才被回收)'''
+        return services.get(self.name) is self
+
+    def _record_state(self):
+        '''把当前状态写入注册表'''
+        if not self._registered():
+            return
+        registry.record_state(
+            self.name, self.state(), pid=self.process and self.process.pid, started_at=self.started_at,
+            exit_code=self.exit_code, exited_at=self.exited_at, next_restart_at=self.next_restart_at,
+            restarts=self.restart_count)
         
+    def on_process_exit(self, proc):
+        '''由回收线程在进程退出后调用'''
+        print(f"Process PID: {proc.pid} has exited with return code: {proc.returncode}")
+        if proc is not self.process: # 已经重启成新进程了
+            return
+        self.exit_code = proc.returncode
+        self.exited_at = time.time()
+        if self._registered():
+            registry.record_exit(self.name, proc.pid, proc.returncode, self.started_at, self.exited_at)
+        self.clean_up()
+        self._schedule_restart(self.exited_at - (self.started_at or self.exited_at))
+        self._record_state()
+
+    def _schedule_restart(self, uptime):
+        '''按重启策略和指数退避安排下一次自动重启，由调度器的定时堆触发，不占用线程'''
+        if self._stopping or self.restart_policy == 'never' or (self.restart_policy == 'on-failure' and self.exit_code == 0):
+            return
+        now = time.time()
+        if uptime >= self.crash_loop_window:
+            self._failures = 0
+        while self._restart_times and self._restart_times[0] < now - self.crash_loop_window:
+            self._restart_times.popleft()
+        if len(self._restart_times) >= self.crash_loop_threshold:
+            self.crash_loop = True
+            print(f"Service {self.name} restarted {len(self._restart_times)} times in {self.crash_loop_window}s, giving up")
+            return
+        delay = min(self.restart_delay * 2 ** self._failures, self.restart_delay_max)
+        self._failures += 1
+        self._restart_times.append(now)
+        self.next_restart_at = now + delay
+        print(f"Restarting service {self.name} in {delay}s")
+        self._restart_timer = scheduler.call_later(delay, self._auto_restart)
+
+    def _cancel_restart(self) -> bool:
+        '''取消尚未执行的自动重启，返回是否有被取消的重启'''
+        timer, self._restart_timer = self._restart_timer, None
+        self.next_restart_at = None
+        if timer and not timer.cancelled:
+            timer.cancel()
+            return True
+        return False
+
+    def _auto_restart(self):
+        self._restart_timer = None
+        self.next_restart_at = None
+        if self._stopping or self.is_running():
+            return
+        self.restart_count += 1
+        try:
+            pid = self.start(auto=True)
+            print(f"{self.name} Restarted with pid: {pid} (restart #{self.restart_count})")
+        except RuntimeError as e:
+            print(f"{self.name} Restart failed: {e}")
+            self.exit_code = None
+            self._schedule_restart(0)
+            self._record_state()
+
     def clean_up(self):
         print(f"Cleaning up service {self.name}")
-        if self.log_file and not self.log_file.closed:
-            self.log_file.close()
         for stream in [self.process.stdin, self.process.stdout, self.process.stderr]:
             if stream and not stream.closed:
                 try:
@@ -195,19 +616,88 @@ class Service:
 
 @app.route('/services')
 def get_services():
+    '''服务列表，直接查询注册表; state=running 等只返回该状态的服务'''
     response.content_type = 'application/json'
-    service_statuses = {
-        name: {
-            "name": name,
-            "cmd": service.cmd,
-            "cwd": service.cwd,
-            "enabled": service.is_enabled,
-            "status": service.status(),
+    service_statuses = {}
+    for row in registry.services(request.query.state or None):
+        config = json.loads(row['config'])
+        service = services.get(row['name'])
+        service_statuses[row['name']] = {
+            "name": row['name'],
+            "cmd": config.get("cmd"),
+            "cwd": config.get("cwd") or os.path.expanduser('~'),
+            "enabled": config.get("is_enabled"),
+            "depends_on": config.get("depends_on") or [],
+            "restart": config.get("restart", "never"),
+            "restarts": row['restarts'],
+            "status": describe_status(row['state'], row['pid'], row['exit_code'], row['next_restart_at']),
+            "exit_code": row['exit_code'],
+            "exited_at": row['exited_at'],
+            "cgroup": service.cgroup_stats() if service else None,
         }
-        for name, service in services.items()
-    }
     return json.dumps(service_statuses, ensure_ascii=False, indent=2)
 
+@app.route('/services/history')
+def get_service_history():
+    '''服务最近的状态变化和退出记录: name=服务名&limit=100'''
+    if request.query.name not in services:
+        abort(404)
+    limit = request.query.limit or '100'
+    if not (limit.isdecimal() and 0 < int(limit) <= 1000):
+        abort(400, 'Invalid limit, must be 1-1000')
+    response.content_type = 'application/json'
+    return json.dumps(registry.history(request.query.name, int(limit)), ensure_ascii=False, indent=2)
+
+@app.route('/services/export')
+def export_services():
+    '''导出所有服务的定义 {name: config}'''
+    response.content_type = 'application/json'
+    response.set_header('Content-Disposition', 'attachment; filename="services.json"')
+    return json.dumps(registry.export(), ensure_ascii=False, indent=4)
+
+@app.route('/services/import', method='POST')
+def import_services():
+    '''
+    批量导入/修改服务定义: 请求体为 {name: config}，replace=1 时删除不在其中的服务
+    先检查全部配置，任何一个不合法都不做修改；然后写入配置文件，整批变化在一个事务中写入注册表
+    '''
+    try:
+        configs = json.load(request.body)
+    except ValueError as e:
+        abort(400, f'Invalid JSON: {e}')
+    if not isinstance(configs, dict):
+        abort(400, 'Expected an object of {name: config}')
+    try:
+        for name, config in configs.items():
+            if not re.fullmatch(r'[\w.-]+', name) or name.startswith('.'):
+                raise ValueError(f"Invalid service name: {name}")
+            validate_config(name, config)
+    except ValueError as e:
+        abort(400, str(e))
+
+    # 先把所有配置写入临时文件，全部写成功后再逐个替换；期间暂停监视器，不会只加载到一部分
+    paths = {name: os.path.join(config_dir, name + '.json') for name in configs}
+    with config_watcher.lock:
+        written = []
+        try:
+            for name, config in configs.items():
+                with open(paths[name] + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(config, f, ensure_ascii=False, indent=4)
+                written.append(paths[name] + '.tmp')
+        except OSError as e:
+            for tmp in written:
+                os.remove(tmp)
+            abort(500, f'Error: {e}')
+        for path in paths.values():
+            os.replace(path + '.tmp', path)
+        if request.query.replace == '1':
+            for name in set(services) - set(configs):
+                path = os.path.join(config_dir, name + '.json')
+                if os.path.isfile(path):
+                    os.remove(path)
+        result = config_watcher.check(debounce=False) or {"added": [], "changed": [], "removed": [], "failed": {}}
+    response.content_type = 'application/json'
+    return json.dumps(result, ensure_ascii=False, indent=2)
 
 @app.route('/test_start', method=['GET', 'POST'])
 def test_start():
@@ -238,34 +728,32 @@ def test_start():
         </html>
         ''')
 
+def bulk_request_args():
+    '''解析批量操作的参数: name=a,b,c&concurrency=4'''
+    names = request.query.name.split(',')
+    if any(name not in services for name in names):
+        abort(404)
+    concurrency = request.query.concurrency
+    if concurrency and not (concurrency.isdecimal() and int(concurrency) > 0):
+        abort(400, 'Invalid concurrency')
+    return names, int(concurrency or 0) or None
+
 @app.route('/start')
 def start():
-    names = request.query.name.split(',')
-    out = ''
-    for name in names:
-        service = services.get(name)
-        if service is None:
-            abort(404)
-        try:
-            pid = service.start()
-            msg = f"{service.name} Started with pid: {str(pid)}"
-        except RuntimeError as e:
-            msg = f"{service.name} Service failed: {str(e)}"
-        out += msg + '\n\n'
-        out = out[:-1] if out.endswith('\n') else out
+    names, concurrency = bulk_request_args()
+    try:
+        results = start_services(names, concurrency)
+    except ValueError as e:
+        abort(400, str(e))
+    out = '\n'.join(results.values())
     print(out)
     return out
 
 @app.route('/stop')
 def stop():
-    names = request.query.name.split(',')
-    out = ''
-    for name in names:
-        service = services.get(name)
-        if service is None:
-            abort(404)
-        out += str(service.stop()) + '\n'
-    return out
+    names, concurrency = bulk_request_args()
+    results = stop_services(names, concurrency)
+    return ''.join(str(result) + '\n' for result in results.values())
 
 @app.route('/restart')
 def restart():
@@ -304,7 +792,9 @@ def update():
         with open(config, 'w', encoding='utf-8') as f:
             f.write(text)
 
-        load_configs()
+        result = config_watcher.check(debounce=False) # 只重新加载有变化的配置
+        if result and name in result["failed"]:
+            abort(400, f'配置文件已保存，但加载失败，服务仍使用原来的配置: {result["failed"][name]}')
         return '保存成功，请重启服务'
     
     with open(config, 'r', encoding='utf-8') as f:
@@ -333,36 +823,143 @@ def delete():
     except OSError as e:
         abort(500, f'Error: {str(e)}')
 
-    if name in services:
-        services[name].stop()
-        services.pop(name)
+    remove_service(name)
     return 'OK'
 
+def parse_time(value) -> float:
+    '''解析时间戳或 ISO 格式的时间 (没有时区时为本地时间)'''
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+def get_service_log(name) -> ServiceLog | None:
+    '''返回服务的日志，还没有任何日志时返回 None'''
+    service_log = services[name].log if name in services else ServiceLog(log_dir, name)
+    if len(service_log.segments()) == 1 and not os.path.isfile(service_log.path):
+        return None
+    return service_log
+
 @app.route('/log')
 def log():
     config = os.path.join(config_dir, request.query.name)
     if not os.path.isfile(config): # 必须是配置文件目录下的文件
         abort(404)
     name = os.path.splitext(os.path.basename(config))[0]
-    offset = int(request.query.offset or 0)
+    try:
+        offset = int(request.query.offset or 0)
+        limit = int(request.query.limit or 0) or None # 最多返回的字节数
+        tail = int(request.query.tail) if request.query.tail else None
+        before = int(request.query.before) if request.query.before else None
+    except ValueError:
+        abort(400, 'Invalid parameter')
+    if (tail is not None and tail < 0) or (before is not None and before < 0):
+        abort(400, 'Invalid parameter')
     
-    if not os.path.isfile(f'{log_dir}{name}.log'):
+    service_log = get_service_log(name)
+    if service_log is None:
         abort(404)
 
-    with open(f'{log_dir}{name}.log', 'rb') as f:
-        f.seek(offset)
-        data = f.read()
+    if tail is not None:
+        # tail=N: 最后 N 行; 加上 before=偏移 时为该偏移之前的 N 行，用于向前翻页
+        data, start, next_offset = service_log.tail(tail, before)
+    else:
+        if request.query.since:
+            # since=2026-10-18T10:00 (本地时间) 或时间戳: 从该时间之后写入的日志开始
+            try:
+                offset = service_log.offset_since(parse_time(request.query.since))
+            except ValueError:
+                abort(400, 'Invalid since')
+        # offset 是跨轮转的逻辑偏移，早于已删除的历史段时从最旧的段开始
+        data, start, next_offset = service_log.read(offset, limit)
         
     response.content_type = 'text/plain; charset=UTF-8'
-    response.headers['X-Next-Offset'] = str(offset + len(data))  # 客户端下次从这里开始读
+    response.headers['X-Log-Start'] = str(start)  # 返回数据的起始偏移，大于 offset 说明中间的日志已被删除
+    response.headers['X-Next-Offset'] = str(next_offset)  # 客户端下次从这里开始读
     return data.decode(encoding=locale.getpreferredencoding(False), errors='ignore')
 
+@app.route('/log/stream')
+def log_stream():
+    '''
+    以 Server-Sent Events 实时推送日志，从 offset (或断线重连时的 Last-Event-ID) 开始，
+    每个事件的 id 为下次读取的逻辑偏移
+    每个连接在打开期间占用一个工作线程 (main.py 的 gevent 下是一个协程)，单独运行时的线程数见 --threads
+    '''
+    config = os.path.join(config_dir, request.query.name)
+    if not os.path.isfile(config): # 必须是配置文件目录下的文件
+        abort(404)
+    name = os.path.splitext(os.path.basename(config))[0]
+    offset = request.headers.get('Last-Event-ID') or request.query.offset or '0'
+    if not offset.isdecimal():
+        abort(400, 'Invalid offset')
+    service_log = services[name].log if name in services else ServiceLog(log_dir, name)
+
+    response.content_type = 'text/event-stream; charset=UTF-8'
+    response.set_header('Cache-Control', 'no-cache')
+    response.set_header('X-Accel-Buffering', 'no') # 禁止反向代理缓冲
+
+    def generate():
+        # 增量解码，读取边界上被截断的多字节字符留到下一块数据再解码
+        decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(errors='replace')
+        yield 'retry: 1000\n\n'
+        for start, data in service_log.follow(int(offset)):
+            if start is None:
+                yield ': keepalive\n\n'
+                continue
+            text = decoder.decode(data)
+            if not text:
+                continue
+            # 解码器中未解码的字节不算已读
+            next_offset = start + len(data) - len(decoder.getstate()[0])
+            lines = re.split(r'\r\n|\r|\n', text)
+            yield f'id: {next_offset}\n' + ''.join(f'data: {line}\n' for line in lines) + '\n'
+    return generate()
+
+@app.route('/log/search')
+def log_search():
+    '''
+    在服务的当前日志和历史段中搜索正则表达式 q，逐条返回命中的行 (每行一个 JSON)，最后一行为汇总
+    since: 只搜索该时间之后的日志; context: 上下文行数; limit: 最多返回的命中数
+    '''
+    config = os.path.join(config_dir, request.query.name)
+    if not os.path.isfile(config): # 必须是配置文件目录下的文件
+        abort(404)
+    name = os.path.splitext(os.path.basename(config))[0]
+    service_log = get_service_log(name)
+    if service_log is None:
+        abort(404)
+
+    pattern = request.query.q
+    try:
+        re.compile(pattern)
+        context = min(int(request.query.context or 0), 20)
+        limit = min(int(request.query.limit or 1000), 10000)
+        offset = service_log.offset_since(parse_time(request.query.since)) if request.query.since else 0
+    except (re.error, ValueError) as e:
+        abort(400, f'Invalid parameter: {e}')
+    if not pattern or limit <= 0 or context < 0:
+        abort(400, 'Invalid parameter')
+    segments = service_log.segments()
+
+    response.content_type = 'application/x-ndjson; charset=UTF-8'
+    response.set_header('X-Accel-Buffering', 'no')
+
+    def generate():
+        hits = 0
+        for hit in logsearch.search_segments(segments, pattern, context, offset, limit,
+                                             locale.getpreferredencoding(False)):
+            hits += 1
+            yield json.dumps(hit, ensure_ascii=False) + '\n'
+        yield json.dumps({"done": True, "hits": hits, "truncated": hits >= limit}) + '\n'
+    return generate()
+
 @app.route('/log_view', name='log_view')
 def log_view():
     return '''
         <html>
         <head><title></title></head>
         <body style="font-family:monospace;background:gray;color:#eee;">
+        <button id="more" style="display:none">加载更早的日志</button>
         <pre id="log" style=""></pre>
         <script>
         const name = new URLSearchParams(location.search).get("name");
@@ -370,26 +967,36 @@ def log_view():
         document.title = "日志查看 - " + name;
         }
         const logElem = document.getElementById("log");
-        let offset = 0;
-
-        async function fetchLog() {
-            try {
-                baseUrl = '/' + window.location.pathname.replace(/\/+$/, '').split('/').slice(1, -1).join('/');
-                if (baseUrl=='/') baseUrl = '';
-                const res = await fetch(`${baseUrl}/log?name=${name}&offset=${offset}`);
-                const text = await res.text();
-                if (text) {
-                    logElem.textContent += text;
-                    window.scrollTo(0, document.body.scrollHeight);
-                }
-                const nextOffset = res.headers.get("X-Next-Offset");
-                if (nextOffset) offset = parseInt(nextOffset);
-            } catch (e) {
-                logElem.textContent += "\\n[读取失败] " + e;
-            }
+
+        baseUrl = '/' + window.location.pathname.replace(/\/+$/, '').split('/').slice(1, -1).join('/');
+        if (baseUrl=='/') baseUrl = '';
+        const moreElem = document.getElementById("more");
+        let firstOffset = 0;
+
+        // 按行向前翻页，每次只读取返回的部分
+        async function fetchEarlier(before) {
+            const res = await fetch(`${baseUrl}/log?name=${encodeURIComponent(name)}&tail=1000` + (before === undefined ? '' : `&before=${before}`));
+            if (!res.ok) return ['', 0]; // 还没有日志
+            const text = await res.text();
+            firstOffset = parseInt(res.headers.get("X-Log-Start"));
+            moreElem.style.display = firstOffset > 0 && text ? '' : 'none';
+            return [text, parseInt(res.headers.get("X-Next-Offset"))];
         }
-        setInterval(fetchLog, 1000);
-        fetchLog();
+        moreElem.onclick = async () => {
+            const [text] = await fetchEarlier(firstOffset);
+            logElem.textContent = text + logElem.textContent;
+        };
+
+        fetchEarlier().then(([text, nextOffset]) => {
+            logElem.textContent = text;
+            window.scrollTo(0, document.body.scrollHeight);
+            // 服务端有新日志时推送，断线后 EventSource 会带上 Last-Event-ID 自动从断点续传
+            const source = new EventSource(`${baseUrl}/log/stream?name=${encodeURIComponent(name)}&offset=${nextOffset}`);
+            source.onmessage = (e) => {
+                logElem.textContent += e.data;
+                window.scrollTo(0, document.body.scrollHeight);
+            };
+        });
         </script>
         </body>
         </html>
@@ -401,36 +1008,39 @@ def clear_log():
     if not os.path.isfile(config): # 必须是配置文件目录下的文件
         abort(404)
     name = os.path.splitext(os.path.basename(config))[0]
-    if not os.path.isfile(f'{log_dir}{name}.log'):
+    service_log = get_service_log(name)
+    if service_log is None:
         return '日志文件不存在'
 
     try:
-        # os.remove(f'{log_dir}{name}.log')
-        with open(f'{log_dir}{name}.log', 'w') as f: # 直接覆盖写入空内容
-            pass  # 或 f.truncate(0)
+        # 删除历史段并清空当前段，逻辑偏移不变
+        service_log.clear()
     except OSError as e:
         return '你需要先停止服务:\n' + str(e)
     return 'OK'
 
 def safe_process_info(p):
     try:
-        return SimpleNamespace(**{
-            'pid': p.pid,
-            'name': p.name(),
-            'cmdline': p.cmdline(),
-            'cwd': p.cwd(),
-            'status': p.status(),
-            'num_threads': p.num_threads(),
-            'exe': p.exe(),
-            'username': p.username(),
-            'create_time': datetime.datetime.fromtimestamp(p.create_time()).strftime("%Y-%m-%d %H:%M:%S"),
-            'memory_usage': format_bytes(p.memory_info().rss),
-        })
+        with p.oneshot():
+            return SimpleNamespace(**{
+                'pid': p.pid,
+                'name': p.name(),
+                'cmdline': p.cmdline(),
+                'cwd': p.cwd(),
+                'status': p.status(),
+                'num_threads': p.num_threads(),
+                'exe': p.exe(),
+                'username': p.username(),
+                'create_time': datetime.datetime.fromtimestamp(p.create_time()).strftime("%Y-%m-%d %H:%M:%S"),
+                'memory_usage': format_bytes(p.memory_info().rss),
+            })
     except (psutil.AccessDenied, psutil.ZombieProcess, psutil.NoSuchProcess):
         return None
 
 @app.route('/processes')
 def search_process():
+    if any(key in request.query for key in ('sort', 'order', 'limit', 'cursor', 'user', 'name', 'service')):
+        return list_processes()
     cmd = request.query.cmd_line
     if cmd.isdecimal() and int(cmd) > 0:
         pid_list = [int(cmd)]
@@ -439,6 +1049,10 @@ def search_process():
 
     psutil_processes = []
     for pid in pid_list:
+        entry = process_table.get(pid)
+        if entry is not None: # 复用进程表中的 psutil.Process
+            psutil_processes.append(entry.process)
+            continue
         try:
             psutil_processes.append(psutil.Process(pid))
         except psutil.NoSuchProcess:
@@ -449,20 +1063,117 @@ def search_process():
     response.content_type = 'application/json'
     return json.dumps([vars(p) for p in processes], ensure_ascii=False, indent=2)
 
+def list_processes():
+    '''
+    分页列出进程: sort=cpu|rss|io|threads|age&order=desc|asc&limit=100&cursor=上一页的next_cursor
+    过滤: cmd_line=命令行子串&user=用户名&name=进程名子串&service=服务名 (服务进程及其子孙进程)
+    '''
+    sort = request.query.sort or 'cpu'
+    if sort not in SORT_KEYS:
+        abort(400, f"Invalid sort, must be one of: {', '.join(SORT_KEYS)}")
+    order = request.query.order or 'desc'
+    if order not in ('asc', 'desc'):
+        abort(400, 'Invalid order')
+    limit = request.query.limit or '100'
+    if not (limit.isdecimal() and 0 < int(limit) <= 1000):
+        abort(400, 'Invalid limit, must be 1-1000')
+    cursor = None
+    if request.query.cursor: # "排序值:pid"
+        try:
+            value, pid = request.query.cursor.rsplit(':', 1)
+            cursor = (float(value), int(pid))
+        except ValueError:
+            abort(400, 'Invalid cursor')
+    pids = None
+    if request.query.service:
+        service = services.get(request.query.service)
+        if service is None:
+            abort(404)
+        # 先刷新进程表，冷启动时表中还没有服务的子进程
+        process_table.ensure_fresh(rates=True)
+        pids = set(process_table.subtree(service.process.pid)) if service.is_running() else set()
+
+    page, total, next_cursor = process_table.query(
+        sort, order == 'desc', int(limit), cursor, command=request.query.cmd_line,
+        user=request.query.user, name=request.query.name, pids=pids)
+    response.content_type = 'application/json'
+    return json.dumps({
+        "total": total,
+        "next_cursor": None if next_cursor is None else f"{next_cursor[0]!r}:{next_cursor[1]}",
+        "processes": [{
+            "pid": entry.pid,
+            "ppid": entry.ppid,
+            "name": entry.name,
+            "username": entry.username,
+            "status": entry.status,
+            "cpu_percent": entry.cpu_percent,
+            "rss": entry.rss,
+            "memory_usage": format_bytes(entry.rss),
+            "io_rate": entry.io_rate,
+            "num_threads": entry.num_threads,
+            "create_time": datetime.datetime.fromtimestamp(entry.create_time).strftime("%Y-%m-%d %H:%M:%S"),
+            "cmdline": entry.args,
+        } for entry in page],
+    }, ensure_ascii=False, indent=2)
+
+@app.route('/process_tree')
+def process_tree():
+    '''
+    进程树，每个节点带有子树的 CPU%、RSS 汇总
+    pid=进程号 或 service=服务名 时只返回以该进程为根的子树
+    '''
+    root = None
+    if request.query.service:
+        service = services.get(request.query.service)
+        if service is None:
+            abort(404)
+        if not service.is_running():
+            return json.dumps([])
+        root = service.process.pid
+    elif request.query.pid:
+        if not request.query.pid.isdecimal():
+            abort(400, 'Invalid pid')
+        root = int(request.query.pid)
+    response.content_type = 'application/json'
+    return json.dumps(process_table.tree(root), ensure_ascii=False)
+
+@app.route('/process_tree/signal')
+def signal_process_tree():
+    '''给进程及其所有子孙进程发送信号: pid=进程号&signal=TERM (默认) / KILL / HUP / 15 ...'''
+    if not request.query.pid.isdecimal():
+        abort(400, 'Invalid pid')
+    name = (request.query.signal or 'TERM').upper()
+    try:
+        sig = signal.Signals(int(name)) if name.isdecimal() else signal.Signals['SIG' + name.removeprefix('SIG')]
+    except (KeyError, ValueError):
+        abort(400, 'Invalid signal')
+    results = process_table.signal_tree(int(request.query.pid), sig)
+    response.content_type = 'application/json'
+    return json.dumps(results, indent=2)
+
 @app.route('/terminate_process')
 def terminate_process():
+    '''
+    批量结束进程: pid=a,b,c&timeout=5
+    同时发送 SIGTERM，timeout 秒后仍未退出的发送 SIGKILL，每行返回一个进程的结果
+    '''
     pids = request.query.pid.split(',')
-    out = ''
-    for pid in pids:
-        out += terminate_process_by_pid(pid) + '\n\n'
-    return out
+    if not all(pid.isdecimal() for pid in pids):
+        abort(400, 'Invalid pid')
+    timeout = request.query.timeout or '5'
+    try:
+        timeout = float(timeout)
+    except ValueError:
+        abort(400, 'Invalid timeout')
+    results = terminate_processes([int(pid) for pid in pids], timeout=max(timeout, 0), table=process_table)
+    return ''.join(f"PID {pid}: {result}\n" for pid, result in results.items())
 
 @atexit.register
 def on_exit():
-    # 停止所有服务
-    for i, (name, service) in enumerate(services.items()):
-        print(f"Stopping service {i+1}/{len(services)}: {service.name}")
-        service.stop()
+    # 按依赖的反序分批并行停止所有服务
+    running = [name for name, service in services.items() if service.is_running()]
+    print(f"Stopping {len(running)} services...")
+    stop_services(running)
 
 load_configs()
 
@@ -472,6 +1183,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Run the development server.')
     parser.add_argument('--host', '-H', default='0.0.0.0', help='Host to listen on (default: 0.0.0.0)')
     parser.add_argument('--port', '-p', type=int, default=8000, help='Port to listen on (default: 8000)')
+    # /log/stream 的每个连接会一直占用一个工作线程，cheroot 默认只有 10 个，打开多个日志页面就会阻塞其它请求
+    parser.add_argument('--threads', '-t', type=int, default=64, help='Worker threads (default: 64)')
     args = parser.parse_args()
 
-    app.run(host=args.host, port=args.port, debug=True, server='cheroot')
+    app.run(host=args.host, port=args.port, debug=True, server='cheroot', numthreads=args.threads)
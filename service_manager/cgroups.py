@@ -0,0 +1,148 @@
+'''
+cgroup v2 资源统计
+
+每个服务的进程树放进单独的 cgroup (默认 <cgroup2 挂载点>/systools/<服务名>)，
+之后直接读取 cpu.stat / memory.current / io.stat / pids.current，
+比用 psutil 遍历所有子进程便宜得多，也能统计到脱离父进程的孙子进程。
+没有权限创建 cgroup 时，退回到发现进程当前所在的 cgroup (例如服务本身由 systemd 管理)。
+仅支持 Linux cgroup v2 (包括 hybrid 模式下的 unified 层级)。
+'''
+import os
+
+CGROUP_PARENT = os.environ.get('SERVICE_CGROUP_PARENT', 'systools')
+CONTROLLERS = ('cpu', 'memory', 'io', 'pids')
+
+_mount_point = False  # False 表示尚未探测
+
+
+def mount_point():
+    '''返回 cgroup2 的挂载点，不支持时返回 None'''
+    global _mount_point
+    if _mount_point is False:
+        _mount_point = None
+        try:
+            with open('/proc/self/mounts', 'r') as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 2 and fields[2] == 'cgroup2':
+                        _mount_point = fields[1]
+                        break
+        except OSError:
+            pass
+    return _mount_point
+
+
+def process_cgroup(pid):
+    '''返回进程所在的 cgroup v2 目录的绝对路径'''
+    root = mount_point()
+    if root is None:
+        return None
+    try:
+        with open(f'/proc/{pid}/cgroup', 'r') as f:
+            for line in f:
+                if line.startswith('0::'):
+                    return os.path.join(root, line[3:].strip().lstrip('/'))
+    except OSError:
+        pass
+    return None
+
+
+def _enable_controllers(path):
+    '''在 path 的 cgroup.subtree_control 中启用子 cgroup 需要的控制器'''
+    try:
+        with open(os.path.join(path, 'cgroup.controllers'), 'r') as f:
+            available = set(f.read().split())
+        with open(os.path.join(path, 'cgroup.subtree_control'), 'r') as f:
+            enabled = set(f.read().split())
+        missing = [c for c in CONTROLLERS if c in available and c not in enabled]
+        if missing:
+            with open(os.path.join(path, 'cgroup.subtree_control'), 'w') as f:
+                f.write(' '.join('+' + c for c in missing))
+    except OSError:
+        # 启用失败时仍可读取 cpu.stat 等基础统计
+        pass
+
+
+def create(name):
+    '''
+    为服务创建 (或复用) cgroup，返回其路径；不支持或没有权限时返回 None
+    '''
+    root = mount_point()
+    if root is None:
+        return None
+    parent = os.path.join(root, CGROUP_PARENT)
+    path = os.path.join(parent, name)
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        return None
+    _enable_controllers(root)
+    _enable_controllers(parent)
+    return path
+
+
+def remove(path):
+    '''删除空的 cgroup，仍有进程时忽略'''
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
+
+
+def attach(path, pid):
+    '''把进程移入 cgroup，之后它 fork 出的子孙进程都在该 cgroup 中'''
+    with open(os.path.join(path, 'cgroup.procs'), 'w') as f:
+        f.write(str(pid))
+
+
+def _read_int(path):
+    try:
+        with open(path, 'r') as f:
+            value = f.read().strip()
+        return None if value == 'max' else int(value)
+    except (OSError, ValueError):
+        return None
+
+
+def _read_flat_keyed(path):
+    '''读取 "key value" 每行一项的文件，如 cpu.stat'''
+    stats = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                key, _, value = line.partition(' ')
+                if value.strip().isdigit():
+                    stats[key] = int(value)
+    except OSError:
+        pass
+    return stats
+
+
+def _read_io_stat(path):
+    '''io.stat 每行一个设备: "8:0 rbytes=1 wbytes=2 rios=3 wios=4 ..."，汇总所有设备'''
+    totals = dict.fromkeys(('rbytes', 'wbytes', 'rios', 'wios'), 0)
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                for item in line.split()[1:]:
+                    key, _, value = item.partition('=')
+                    if key in totals:
+                        totals[key] += int(value)
+    except (OSError, ValueError):
+        return None
+    return totals
+
+
+def read_stats(path):
+    '''读取 cgroup 的资源统计，cgroup 不存在时返回 None'''
+    if not path or not os.path.isdir(path):
+        return None
+    cpu = _read_flat_keyed(os.path.join(path, 'cpu.stat'))
+    return {
+        'path': path,
+        'cpu_seconds': cpu['usage_usec'] / 1e6 if 'usage_usec' in cpu else None,
+        'memory_current': _read_int(os.path.join(path, 'memory.current')),
+        'memory_max': _read_int(os.path.join(path, 'memory.max')),
+        'pids_current': _read_int(os.path.join(path, 'pids.current')),
+        'io': _read_io_stat(os.path.join(path, 'io.stat')),
+    }
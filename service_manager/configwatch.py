@@ -0,0 +1,123 @@
+'''
+监视服务配置目录，增量重新加载配置
+
+定期 (由调度器的定时堆触发) 用 scandir 读取目录中配置文件的 mtime 和大小，
+只有新增、修改、删除的文件才交给回调处理，几百个配置文件时修改一个只需要解析一个文件。
+检查在单独的工作线程中进行：应用配置时停止服务可能要等几秒，不能阻塞调度线程上其它服务的重启定时器。
+连续的修改 (编辑器保存时常见的先截断再写入、批量复制) 在目录安静 debounce 秒后才一起应用。
+'''
+import os
+import threading
+import time
+
+try:
+    from .scheduler import scheduler
+except ImportError: # 直接运行 app.py 时
+    from scheduler import scheduler
+
+POLL_INTERVAL = 1 # 检查目录的间隔(秒)
+DEBOUNCE = 0.5 # 最后一次修改后等待的秒数
+
+
+class ConfigWatcher:
+    def __init__(self, directory, apply, suffix='.json', interval=POLL_INTERVAL, debounce=DEBOUNCE):
+        '''
+        apply(added, changed, removed): 三个文件名列表，在检查线程 (或调用 check 的线程) 中调用，
+        返回加载失败的文件 {文件名: 错误}，失败的文件不算已应用
+        '''
+        self.directory = directory
+        self.apply = apply
+        self.suffix = suffix
+        self.interval = interval
+        self.debounce = debounce
+        self.lock = threading.RLock() # 批量修改配置文件时持有，定期检查不会看到只改了一半的目录
+        self._applied = {} # 已应用的 文件名 -> (mtime_ns, size)
+        self._seen = {} # 最近一次检查看到的
+        self._failed = {} # 加载失败的 文件名 -> (mtime_ns, size)，文件再次变化前定期检查时不重试
+        self._changed_at = 0 # 最近一次看到目录变化的时间
+        self._timer = None
+        self._worker = None # 正在执行定期检查的线程
+
+    def scan(self) -> dict[str, tuple[int, int]]:
+        snapshot = {}
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(self.suffix):
+                    continue
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        snapshot[entry.name] = (stat.st_mtime_ns, stat.st_size)
+                except FileNotFoundError: # 扫描期间被删除
+                    pass
+        return snapshot
+
+    def mark_applied(self, snapshot):
+        '''记录已经加载过的配置 (启动时全部加载后调用)'''
+        with self.lock:
+            self._applied = dict(snapshot)
+            self._seen = dict(snapshot)
+
+    def check(self, debounce=True) -> dict | None:
+        '''
+        比较目录和已应用的配置，有差异时调用 apply 并返回 {"added", "changed", "removed", "failed"}
+        debounce=False 时立即应用 (包括重试加载失败的文件)，用于保存配置后马上生效
+        '''
+        with self.lock:
+            current = self.scan()
+            now = time.monotonic()
+            if current != self._seen:
+                self._seen = current
+                self._changed_at = now
+                if debounce:
+                    return None
+            if current == self._applied or (debounce and now - self._changed_at < self.debounce):
+                return None
+            pending = {name: stat for name, stat in current.items()
+                       if stat != self._applied.get(name) and not (debounce and stat == self._failed.get(name))}
+            removed = sorted(name for name in self._applied if name not in current)
+            if not pending and not removed:
+                return None
+            added = sorted(name for name in pending if name not in self._applied)
+            changed = sorted(name for name in pending if name in self._applied)
+            failed = self.apply(added, changed, removed) or {}
+            for name in removed:
+                del self._applied[name]
+            for name, stat in pending.items():
+                if name in failed:
+                    self._failed[name] = stat
+                else:
+                    self._applied[name] = stat
+                    self._failed.pop(name, None)
+            for name in list(self._failed):
+                if name not in current:
+                    del self._failed[name]
+            return {
+                "added": [name for name in added if name not in failed],
+                "changed": [name for name in changed if name not in failed],
+                "removed": removed,
+                "failed": failed,
+            }
+
+    def _check(self):
+        try:
+            self.check()
+        except Exception as e:
+            print(f"Config watcher error: {e}")
+
+    def _tick(self):
+        # 调度线程只负责触发，上一次检查还没结束 (例如正在停止被删除的服务) 时跳过这一次
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._check, name='config-watcher', daemon=True)
+            self._worker.start()
+        if self._timer is not None:
+            self._timer = scheduler.call_later(self.interval, self._tick)
+
+    def start(self):
+        if self._timer is None:
+            self._timer = scheduler.call_later(self.interval, self._tick)
+
+    def stop(self):
+        timer, self._timer = self._timer, None
+        if timer:
+            timer.cancel()
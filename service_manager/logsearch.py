@@ -0,0 +1,182 @@
+'''
+在服务日志的各个段中搜索正则表达式
+
+未压缩的段用 mmap 映射后直接在上面做正则搜索，不需要读入内存；压缩段流式解压，逐块搜索。
+需要搜索多个段时，每个段由一个单独的子进程 (python logsearch.py 参数) 搜索，结果按日志顺序合并，
+子进程只是独立运行本文件，不会导入 service_manager，也就不会重复启动服务。
+'''
+import json
+import mmap
+import os
+import re
+import subprocess
+import sys
+
+import zstandard as zstd
+
+SEARCH_CHUNK = 1024 * 1024
+MAX_LINE = 4096 # 返回的每行最多的字符数
+POOL_SIZE = min(os.cpu_count() or 1, 4) # 同时搜索的段数
+
+
+def _line(buf, start, end, encoding):
+    return bytes(buf[start:end]).rstrip(b'\r').decode(encoding, errors='replace')[:MAX_LINE]
+
+
+def _complete_lines(buf, pos, end, count, encoding) -> list[str]:
+    '''从 pos 开始读取最多 count 个完整的行 (在 end 之前以换行结尾)，不返回段或块边界上截断的半行'''
+    lines = []
+    while len(lines) < count:
+        following = buf.find(b'\n', pos, end)
+        if following < 0:
+            break
+        lines.append(_line(buf, pos, following, encoding))
+        pos = following + 1
+    return lines
+
+
+def scan_buffer(buf, base, rx, context, encoding, pos=0, end=None):
+    '''
+    在 buf (bytes 或 mmap) 的 [pos, end) 中搜索，生成命中的行 {"offset", "line", "before", "after"}，
+    base 为 buf 开头的逻辑偏移。每行最多命中一次；后续上下文只取 end 之前的完整行，可能不足 context 行
+    '''
+    end = len(buf) if end is None else end
+    while pos < end:
+        match = rx.search(buf, pos, end)
+        if match is None:
+            return
+        line_start = buf.rfind(b'\n', 0, match.start()) + 1
+        line_end = buf.find(b'\n', match.start())
+        if line_end < 0:
+            line_end = len(buf)
+        before = []
+        start = line_start
+        while len(before) < context and start > 0:
+            prev = buf.rfind(b'\n', 0, start - 1) + 1
+            before.insert(0, _line(buf, prev, start - 1, encoding))
+            start = prev
+        after = _complete_lines(buf, line_end + 1, end, context, encoding) if line_end < end else []
+        yield {
+            "offset": base + line_start,
+            "line": _line(buf, line_start, line_end, encoding),
+            "before": before,
+            "after": after,
+        }
+        pos = line_end + 1
+
+
+def search_segment(path, compressed, segment_start, pattern, context=0, offset=0, max_hits=1000,
+                   encoding='utf-8'):
+    '''在一个段中从逻辑偏移 offset 开始搜索，最多生成 max_hits 个结果'''
+    rx = re.compile(pattern.encode(encoding), re.MULTILINE)
+    pos = max(offset - segment_start, 0)
+    hits = 0
+    if not compressed:
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError: # 搜索期间已被压缩
+            path, compressed = path + '.zst', True
+    if not compressed:
+        with f:
+            if os.fstat(f.fileno()).st_size <= pos:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                for hit in scan_buffer(buf, segment_start, rx, context, encoding, pos):
+                    yield hit
+                    hits += 1
+                    if hits >= max_hits:
+                        return
+        return
+
+    with open(path, 'rb') as f, zstd.ZstdDecompressor().stream_reader(f) as stream:
+        base = segment_start # buffer 开头的逻辑偏移
+        buffer = b''
+        pending = [] # 后续上下文跨到下一块的命中，按顺序等下一块补全后再返回
+        carry = 0 # pending 中的命中都停在这个逻辑偏移 (上一块的末尾)
+        while True:
+            chunk = stream.read(SEARCH_CHUNK)
+            buffer += chunk
+            # 只搜索到最后一个完整的行，剩下的和下一块一起搜索；保留前 context 行作为上下文
+            end = len(buffer) if not chunk else buffer.rfind(b'\n') + 1
+            if pending:
+                more = _complete_lines(buffer, carry - base, end, context, encoding)
+                for hit in pending:
+                    hit["after"].extend(more[:context - len(hit["after"])])
+                ready = 0
+                while ready < len(pending) and (not chunk or len(pending[ready]["after"]) == context):
+                    ready += 1
+                for hit in pending[:ready]:
+                    yield hit
+                    hits += 1
+                    if hits >= max_hits:
+                        return
+                del pending[:ready]
+                carry = base + end
+            search_from = max(pos - (base - segment_start), 0)
+            if end > search_from:
+                for hit in scan_buffer(buffer, base, rx, context, encoding, search_from, end):
+                    if pending or (chunk and len(hit["after"]) < context):
+                        pending.append(hit)
+                        carry = base + end
+                        continue
+                    yield hit
+                    hits += 1
+                    if hits >= max_hits:
+                        return
+                if not chunk:
+                    return
+                keep = end
+                for _ in range(context):
+                    keep = buffer.rfind(b'\n', 0, max(keep - 1, 0)) + 1
+                    if not keep:
+                        break
+                pos = max(pos, base - segment_start + end)
+                base += keep
+                buffer = buffer[keep:]
+            elif not chunk:
+                return
+
+
+def search_segments(segments, pattern, context=0, offset=0, max_hits=1000, encoding='utf-8'):
+    '''
+    按日志顺序搜索多个段，总共最多生成 max_hits 个结果
+    多个段时同时启动最多 POOL_SIZE 个子进程搜索，按顺序读取它们的输出，后面的段在管道满后自动等待
+    '''
+    segments = [segment for segment in segments if segment.end > offset or segment is segments[-1]]
+    if len(segments) <= 1:
+        for segment in segments:
+            yield from search_segment(segment.path, segment.compressed, segment.start, pattern, context,
+                                      offset, max_hits, encoding)
+        return
+
+    def spawn(segment):
+        args = [segment.path, segment.compressed, segment.start, pattern, context, offset, max_hits, encoding]
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__), json.dumps(args)],
+                                stdout=subprocess.PIPE, stdin=subprocess.DEVNULL)
+
+    workers = [spawn(segment) for segment in segments[:POOL_SIZE]]
+    pending = segments[POOL_SIZE:]
+    hits = 0
+    try:
+        while workers:
+            for line in workers[0].stdout:
+                yield json.loads(line)
+                hits += 1
+                if hits >= max_hits:
+                    return
+            worker = workers.pop(0)
+            worker.stdout.close()
+            worker.wait()
+            if pending:
+                workers.append(spawn(pending.pop(0)))
+    finally:
+        # 达到命中上限或客户端断开时结束剩下的子进程
+        for worker in workers:
+            worker.kill()
+            worker.stdout.close()
+            worker.wait()
+
+
+if __name__ == '__main__':
+    for hit in search_segment(*json.loads(sys.argv[1])):
+        sys.stdout.write(json.dumps(hit) + '\n')
@@ -0,0 +1,599 @@
+'''
+服务日志的存储、轮转和读取
+
+服务的 stdout/stderr 不再直接写入日志文件，而是写入管道，由 LogPump 的一个后台线程统一读取所有服务的管道，
+写入 ServiceLog。这样轮转时不需要子进程配合，也不会丢失或重复数据。
+
+每个服务的日志由若干段组成:
+    <name>.log                    当前正在写入的段
+    <name>.log.<start>-<end>      刚轮转出来、等待压缩的段
+    <name>.log.<start>-<end>.zst  压缩后的历史段
+    <name>.log.base               当前段第一个字节的逻辑偏移
+    <name>.log.idx                稀疏的行首索引
+start/end 是段在整个日志中的逻辑偏移 (从服务第一次写日志开始累计的字节数)，
+轮转、压缩、按保留策略删除旧段都不会改变逻辑偏移，所以 /log?offset= 的客户端不会漏读或重复读。
+
+行首索引每隔 INDEX_INTERVAL 字节或 INDEX_TIME_INTERVAL 秒记录一个 (逻辑偏移, 行号, 写入时间)，
+按行号 (tail) 或时间 (since) 定位时先二分查找索引，再从最近的索引项向后最多扫描一个间隔，
+所以每次请求读取的数据量与返回的数据量相当，而不是整个日志。
+'''
+import bisect
+import os
+import queue
+import re
+import selectors
+import struct
+import threading
+import time
+from array import array
+
+import zstandard as zstd
+
+# 默认的轮转和保留策略，可以在服务配置的 "log" 中覆盖
+LOG_MAX_SIZE = 10 * 1024 * 1024 # 当前段超过该大小时轮转
+LOG_MAX_AGE = 0 # 当前段写入超过该秒数时轮转，0 表示不按时间轮转
+LOG_MAX_SEGMENTS = 10 # 最多保留的历史段数
+LOG_RETENTION = 0 # 历史段最长保留秒数，0 表示不限
+COMPRESS_LEVEL = 3
+READ_CHUNK = 64 * 1024
+FOLLOW_QUEUE_SIZE = 256 # 每个实时订阅者最多缓存的写入次数，超过后改为从文件追赶
+FOLLOW_KEEPALIVE = 15
+INDEX_INTERVAL = 64 * 1024 # 行首索引项之间最多间隔的字节数
+INDEX_TIME_INTERVAL = 1 # 行首索引项之间最多间隔的秒数，决定按时间定位的精度
+INDEX_RECORD = struct.Struct('<qqd') # 逻辑偏移, 行号, 写入时间
+
+
+class Segment:
+    __slots__ = ('start', 'end', 'path', 'compressed')
+
+    def __init__(self, start, end, path, compressed=False):
+        self.start = start
+        self.end = end
+        self.path = path
+        self.compressed = compressed
+
+    def open(self):
+        '''返回解压后的字节流，读取方式与普通文件相同'''
+        f = open(self.path, 'rb')
+        if self.compressed:
+            return zstd.ZstdDecompressor().stream_reader(f, closefd=True)
+        return f
+
+
+def skip(stream, count):
+    '''在不支持 seek 的压缩流中向前跳过 count 字节'''
+    while count > 0:
+        data = stream.read(min(count, READ_CHUNK))
+        if not data:
+            break
+        count -= len(data)
+
+
+class ServiceLog:
+    def __init__(self, log_dir, name, **options):
+        self.log_dir = log_dir
+        self.name = name
+        self.path = os.path.join(log_dir, f'{name}.log')
+        self._base_path = self.path + '.base'
+        self._segment_re = re.compile(re.escape(f'{name}.log.') + r'(\d+)-(\d+)(\.zst)?$')
+        self._lock = threading.RLock()
+        self._file = None
+        self._opened_at = None
+        self._base = None # 当前段的逻辑偏移，缓存 .base 文件的内容
+        self._listeners = set() # 实时订阅者，每次写入后调用 listener(起始偏移, 数据)
+        self._index_path = self.path + '.idx'
+        self._index_loaded = False
+        self._reset_index()
+        self.configure(**options)
+
+    def configure(self, max_size=LOG_MAX_SIZE, max_age=LOG_MAX_AGE, max_segments=LOG_MAX_SEGMENTS,
+                  retention=LOG_RETENTION):
+        '''
+        max_size / max_age: 当前段的大小(字节) / 写入时间(秒) 超过该值时轮转，0 表示不限
+        max_segments / retention: 最多保留的历史段数 / 历史段最长保留的秒数，0 表示不限
+        '''
+        self.max_size = max_size
+        self.max_age = max_age
+        self.max_segments = max_segments
+        self.retention = retention
+
+    def base_offset(self) -> int:
+        if self._base is None:
+            try:
+                with open(self._base_path, 'r') as f:
+                    self._base = int(f.read().strip() or 0)
+            except (OSError, ValueError):
+                self._base = 0
+        return self._base
+
+    def _set_base_offset(self, offset):
+        tmp = self._base_path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(offset))
+        os.replace(tmp, self._base_path)
+        self._base = offset
+
+    def _active_size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def segments(self) -> list[Segment]:
+        '''按逻辑偏移排序的所有段，最后一个为当前段'''
+        with self._lock:
+            found = {}
+            try:
+                filenames = os.listdir(self.log_dir)
+            except OSError:
+                filenames = []
+            for filename in filenames:
+                match = self._segment_re.match(filename)
+                if match:
+                    start, end = int(match[1]), int(match[2])
+                    # 压缩中途退出时两种文件都在，压缩文件是完整的
+                    if start not in found or match[3]:
+                        found[start] = Segment(start, end, os.path.join(self.log_dir, filename), bool(match[3]))
+            result = sorted(found.values(), key=lambda s: s.start)
+            base = self.base_offset()
+            result.append(Segment(base, base + self._active_size(), self.path))
+            return result
+
+    def end_offset(self) -> int:
+        with self._lock:
+            return self.base_offset() + self._active_size()
+
+    def _reset_index(self):
+        self._index_offsets = array('q')
+        self._index_lines = array('q')
+        self._index_times = array('d')
+        self._index_unsaved = [] # 还没有写入 .idx 文件的索引项
+        self._lines = 0 # 已写入的换行符总数，即下一个行首的行号
+        self._at_line_start = True # 最后一个字节是否为换行符
+
+    def _load_index(self):
+        '''第一次需要索引时加载 .idx 文件，没有索引文件时扫描已有的日志建立索引'''
+        if self._index_loaded:
+            return
+        self._index_loaded = True
+        self._reset_index()
+        try:
+            with open(self._index_path, 'rb') as f:
+                records = f.read()
+        except OSError:
+            records = b''
+        records = records[:len(records) - len(records) % INDEX_RECORD.size]
+        for offset, line, when in INDEX_RECORD.iter_unpack(records):
+            self._index_offsets.append(offset)
+            self._index_lines.append(line)
+            self._index_times.append(when)
+
+        if self._index_offsets:
+            # 从最后一个索引项扫描到末尾，恢复行号
+            offset = self._index_offsets[-1]
+            self._lines = self._index_lines[-1]
+            scan_time = self._index_times[-1]
+            segments = [s for s in self.segments() if s.end > offset]
+        else:
+            segments = self.segments()
+            offset = segments[0].start
+            scan_time = None
+        for segment in segments:
+            # 没有索引的旧日志以段的修改时间作为写入时间
+            when = scan_time
+            if when is None:
+                try:
+                    when = os.path.getmtime(segment.path)
+                except OSError:
+                    when = time.time()
+            try:
+                stream = segment.open()
+            except OSError:
+                continue
+            with stream:
+                if offset > segment.start:
+                    if segment.compressed:
+                        skip(stream, offset - segment.start)
+                    else:
+                        stream.seek(offset - segment.start)
+                offset = max(offset, segment.start)
+                while chunk := stream.read(READ_CHUNK):
+                    self._index_chunk(offset, chunk, when)
+                    offset += len(chunk)
+        self._save_index()
+
+    def _index_chunk(self, offset, data, now):
+        '''写入 data (起始逻辑偏移 offset) 时更新行号，需要时记录新的索引项'''
+        if self._at_line_start:
+            line_start, line = 0, self._lines
+        else:
+            line_start, line = data.find(b'\n') + 1, self._lines + 1
+        if (line_start or self._at_line_start) and line_start < len(data) and (
+                not self._index_offsets
+                or offset + line_start - self._index_offsets[-1] >= INDEX_INTERVAL
+                or now - self._index_times[-1] >= INDEX_TIME_INTERVAL):
+            self._index_offsets.append(offset + line_start)
+            self._index_lines.append(line)
+            self._index_times.append(now)
+            self._index_unsaved.append((offset + line_start, line, now))
+        self._lines += data.count(b'\n')
+        self._at_line_start = data.endswith(b'\n')
+
+    def _save_index(self, rewrite=False):
+        if rewrite:
+            records = zip(self._index_offsets, self._index_lines, self._index_times)
+        elif self._index_unsaved:
+            records = self._index_unsaved
+        else:
+            return
+        try:
+            os.makedirs(self.log_dir, exist_ok=True)
+            with open(self._index_path, 'wb' if rewrite else 'ab') as f:
+                f.write(b''.join(INDEX_RECORD.pack(*record) for record in records))
+        except OSError as e:
+            print(f"Saving log index {self._index_path} failed: {e}")
+        self._index_unsaved = []
+
+    def _prune_index(self):
+        '''删除已被删除的段中的索引项'''
+        first = bisect.bisect_left(self._index_offsets, self.segments()[0].start)
+        if first:
+            del self._index_offsets[:first]
+            del self._index_lines[:first]
+            del self._index_times[:first]
+            self._save_index(rewrite=True)
+
+    def write(self, data):
+        with self._lock:
+            self._load_index()
+            if self._file is None:
+                os.makedirs(self.log_dir, exist_ok=True)
+                self._file = open(self.path, 'ab')
+                self._opened_at = time.time()
+            # 以文件的实际大小计算偏移: clear() 截断后 tell() 仍停在截断前的位置
+            size = self._active_size()
+            offset = self.base_offset() + size
+            self._file.write(data)
+            self._file.flush()
+            self._index_chunk(offset, data, time.time())
+            self._save_index()
+            for listener in list(self._listeners):
+                listener(offset, data)
+            if self.max_size and size + len(data) >= self.max_size:
+                self.rotate()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def rotate_if_expired(self, now=None):
+        '''按时间轮转，由 LogPump 定期调用'''
+        now = time.time() if now is None else now
+        with self._lock:
+            if self.max_age and self._opened_at and now - self._opened_at >= self.max_age and self._active_size():
+                self.rotate()
+
+    def rotate(self):
+        '''把当前段改名为历史段，在后台线程中压缩，之后的日志写入新的当前段'''
+        with self._lock:
+            size = self._active_size()
+            if not size:
+                return
+            reopen = self._file is not None
+            self.close()
+            start = self.base_offset()
+            end = start + size
+            segment = os.path.join(self.log_dir, f'{self.name}.log.{start}-{end}')
+            os.replace(self.path, segment)
+            self._set_base_offset(end)
+            if reopen:
+                self._file = open(self.path, 'ab')
+                self._opened_at = time.time()
+        threading.Thread(target=self._compress, args=(segment,), daemon=True).start()
+
+    def _compress(self, path):
+        try:
+            with open(path, 'rb') as src, open(path + '.zst.tmp', 'wb') as dst:
+                zstd.ZstdCompressor(level=COMPRESS_LEVEL).copy_stream(src, dst)
+            with self._lock:
+                os.replace(path + '.zst.tmp', path + '.zst')
+                os.remove(path)
+        except OSError as e:
+            print(f"Compressing log segment {path} failed: {e}")
+        self.apply_retention()
+
+    def apply_retention(self):
+        with self._lock:
+            history = self.segments()[:-1]
+            now = time.time()
+            expired = []
+            if self.max_segments and len(history) > self.max_segments:
+                expired = history[:len(history) - self.max_segments]
+            if self.retention:
+                for segment in history[len(expired):]:
+                    try:
+                        if now - os.path.getmtime(segment.path) > self.retention:
+                            expired.append(segment)
+                    except OSError:
+                        pass
+            for segment in expired:
+                try:
+                    os.remove(segment.path)
+                except OSError:
+                    pass
+            if expired and self._index_loaded:
+                self._prune_index()
+
+    def clear(self):
+        '''删除所有历史段并清空当前段，逻辑偏移继续累计，正在读取的客户端不受影响'''
+        with self._lock:
+            end = self.end_offset()
+            for segment in self.segments()[:-1]:
+                try:
+                    os.remove(segment.path)
+                except OSError:
+                    pass
+            if self._file is not None:
+                self._file.truncate(0)
+                self._file.seek(0)
+            elif os.path.exists(self.path):
+                with open(self.path, 'wb'):
+                    pass
+            self._set_base_offset(end)
+            if self._index_loaded:
+                self._prune_index()
+
+    def read(self, offset=0, limit=None) -> tuple[bytes, int, int]:
+        '''
+        从逻辑偏移 offset 开始读取，最多 limit 字节 (None 表示读到末尾)
+        返回 (数据, 数据起始偏移, 下次读取的偏移)；offset 早于最旧的段时从最旧的段开始
+        '''
+        with self._lock:
+            segments = self.segments()
+            start = min(max(offset, segments[0].start), segments[-1].end)
+            # 在锁内打开文件，之后即使轮转改名或压缩删除也能继续读取
+            streams = []
+            for segment in segments:
+                if segment.end > start or segment is segments[-1]:
+                    try:
+                        streams.append((segment, segment.open()))
+                    except OSError:
+                        pass
+        chunks = []
+        remaining = limit
+        position = start
+        for segment, stream in streams:
+            with stream:
+                if remaining is not None and remaining <= 0:
+                    continue
+                if position > segment.start:
+                    if segment.compressed:
+                        skip(stream, position - segment.start)
+                    else:
+                        stream.seek(position - segment.start)
+                # 当前段在打开后可能还有新的写入，历史段不会变
+                size = None if segment is segments[-1] else segment.end - max(position, segment.start)
+                if remaining is not None:
+                    size = remaining if size is None else min(size, remaining)
+                data = stream.read() if size is None else stream.read(size)
+                chunks.append(data)
+                position += len(data)
+                if remaining is not None:
+                    remaining -= len(data)
+        return b''.join(chunks), start, position
+
+    def _line_offset(self, line) -> int:
+        '''第 line 行的行首偏移，早于最旧的索引项时返回最旧的索引项'''
+        i = bisect.bisect_right(self._index_lines, line) - 1
+        if i < 0:
+            return self._index_offsets[0] if self._index_offsets else self.segments()[0].start
+        offset, current = self._index_offsets[i], self._index_lines[i]
+        while current < line:
+            data, _, next_offset = self.read(offset, READ_CHUNK)
+            if not data:
+                break
+            pos = 0
+            while current < line:
+                pos = data.find(b'\n', pos) + 1
+                if not pos:
+                    break
+                current += 1
+            if current == line:
+                return offset + pos
+            offset = next_offset
+        return offset
+
+    def _line_number(self, offset) -> int:
+        '''offset 所在行的行号'''
+        i = bisect.bisect_right(self._index_offsets, offset) - 1
+        if i < 0:
+            return self._index_lines[0] if self._index_lines else 0
+        position, line = self._index_offsets[i], self._index_lines[i]
+        while position < offset:
+            data, _, position = self.read(position, min(offset - position, READ_CHUNK))
+            if not data:
+                break
+            line += data.count(b'\n')
+        return line
+
+    def tail(self, lines, before=None) -> tuple[bytes, int, int]:
+        '''
+        读取 before (默认为末尾) 之前的最后 lines 行，用于 tail -n 和向前翻页，返回值同 read()
+        '''
+        with self._lock:
+            self._load_index()
+            end = self.end_offset() if before is None else min(before, self.end_offset())
+            start = self._line_offset(max(self._line_number(end) - lines, 0))
+            start = min(max(start, self.segments()[0].start), end)
+            return self.read(start, end - start)
+
+    def offset_since(self, timestamp) -> int:
+        '''在 timestamp 之后写入的第一行所在的索引区间的起始偏移，精度为 INDEX_TIME_INTERVAL 秒'''
+        with self._lock:
+            self._load_index()
+            i = bisect.bisect_right(self._index_times, timestamp) - 1
+            if i < 0:
+                return self.segments()[0].start
+            # 距上一个索引项超过 INDEX_TIME_INTERVAL 秒的写入一定会记录新的索引项，
+            # 所以这个区间内的数据都写于 timestamp 之前
+            if self._index_times[i] + INDEX_TIME_INTERVAL <= timestamp:
+                return self._index_offsets[i + 1] if i + 1 < len(self._index_offsets) else self.end_offset()
+            return self._index_offsets[i]
+
+    def subscribe(self, listener):
+        with self._lock:
+            self._listeners.add(listener)
+
+    def unsubscribe(self, listener):
+        with self._lock:
+            self._listeners.discard(listener)
+
+    def follow(self, offset=0, keepalive=FOLLOW_KEEPALIVE):
+        '''
+        从逻辑偏移 offset 开始读取，之后持续推送新写入的数据，生成 (数据起始偏移, 数据)，
+        超过 keepalive 秒没有新数据时生成一次 (None, b'')，用于保持连接。
+        所有订阅者共用 LogPump 的读取，写入时直接把数据放进各订阅者的队列，不需要轮询文件；
+        订阅者太慢导致队列满时退订，从文件追赶上来后重新订阅
+        '''
+        while True:
+            pending = queue.Queue(FOLLOW_QUEUE_SIZE)
+            lagging = threading.Event()
+
+            def listener(start, data):
+                try:
+                    pending.put_nowait((start, data))
+                except queue.Full:
+                    lagging.set()
+                    self._listeners.discard(listener)
+
+            # 先订阅再读取已有的数据，读取期间的写入会留在队列里，按偏移去重
+            self.subscribe(listener)
+            try:
+                while True:
+                    data, start, offset = self.read(offset, READ_CHUNK)
+                    if data:
+                        yield start, data
+                    if len(data) < READ_CHUNK:
+                        break
+                while not (lagging.is_set() and pending.empty()):
+                    try:
+                        start, data = pending.get(timeout=keepalive)
+                    except queue.Empty:
+                        yield None, b''
+                        continue
+                    if start + len(data) <= offset:
+                        continue
+                    if start < offset:
+                        data = data[offset - start:]
+                        start = offset
+                    yield start, data
+                    offset = start + len(data)
+            finally:
+                self.unsubscribe(listener)
+
+    def remove(self):
+        '''删除该服务的所有日志'''
+        with self._lock:
+            self.close()
+            for segment in self.segments():
+                try:
+                    os.remove(segment.path)
+                except OSError:
+                    pass
+            for path in (self._base_path, self._index_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._base = None
+            self._index_loaded = False
+            self._reset_index()
+
+
+class LogPump:
+    '''
+    用一个后台线程读取所有服务的输出管道并写入对应的 ServiceLog
+    不支持在管道上 select 的平台 (Windows) 退回到每个管道一个读取线程
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._use_selector = os.name == 'posix'
+        self._selector = selectors.DefaultSelector() if self._use_selector else None
+        self._logs = set() # 需要检查按时间轮转的日志
+        self._thread = None
+        if self._use_selector:
+            self._wake_r, self._wake_w = os.pipe()
+            os.set_blocking(self._wake_r, False)
+            self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+    def attach(self, fd, log):
+        '''读取管道 fd 直到 EOF，写入 log，EOF 后关闭 fd'''
+        with self._lock:
+            self._logs.add(log)
+        if not self._use_selector:
+            threading.Thread(target=self._read_blocking, args=(fd, log), daemon=True).start()
+            return
+        os.set_blocking(fd, False)
+        with self._lock:
+            self._selector.register(fd, selectors.EVENT_READ, log)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='log-pump', daemon=True)
+                self._thread.start()
+        os.write(self._wake_w, b'\0')
+
+    def _read_blocking(self, fd, log):
+        try:
+            while data := os.read(fd, READ_CHUNK):
+                log.write(data)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _run(self):
+        last_check = time.time()
+        while True:
+            try:
+                for key, _ in self._selector.select(60):
+                    if key.data is None:
+                        try:
+                            os.read(self._wake_r, 4096)
+                        except BlockingIOError:
+                            pass
+                        continue
+                    self._pump(key.fd, key.data)
+                now = time.time()
+                if now - last_check >= 60:
+                    last_check = now
+                    with self._lock:
+                        logs = list(self._logs)
+                    for log in logs:
+                        log.rotate_if_expired(now)
+            except Exception as e:
+                print(f"Log pump error: {e}")
+                time.sleep(1)
+
+    def _pump(self, fd, log):
+        try:
+            data = os.read(fd, READ_CHUNK)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if data:
+            log.write(data)
+            return
+        # EOF: 服务及其所有子进程都已关闭输出
+        with self._lock:
+            self._selector.unregister(fd)
+        os.close(fd)
+
+    def forget(self, log):
+        with self._lock:
+            self._logs.discard(log)
+
+
+pump = LogPump()
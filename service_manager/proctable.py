@@ -0,0 +1,412 @@
+'''
+进程表缓存
+
+后台线程定期刷新，每次只比较 pid 集合的差异: 只为新出现的进程读取 ppid/name/cmdline，退出的进程从表中删除，
+同时维护命令行的分词倒排索引，按命令行搜索进程时不需要启动 pgrep / PowerShell 子进程，也不需要逐个读取 /proc。
+最近有列表/进程树查询时，刷新还会给所有进程采样 CPU 时间、内存、IO 和线程数，CPU% 和 IO 速率由前后两次采样的差值计算，
+列出进程时在内存中过滤后只取出当前页需要的条目 (堆选择，不对所有匹配的进程排序)。
+'''
+import heapq
+import re
+import threading
+import time
+
+import psutil
+
+REFRESH_INTERVAL = 2 # 刷新间隔(秒)
+IDLE_TIMEOUT = 60 # 超过该秒数没有查询时停止后台刷新，下次查询时再启动
+FIRST_SAMPLE_DELAY = 0.5 # 第一次查询时两次采样的间隔(秒)，否则还算不出 CPU%
+KILL_TIMEOUT = 1 # 发送 SIGKILL 后等待进程消失的秒数
+WAIT_INTERVAL = 0.05 # 等待进程退出时检查的间隔(秒)
+
+# 排序字段 -> 取值，都是越大越靠前 (倒序) 的值；age 用 -create_time，不随时间变化，翻页游标才稳定
+SORT_KEYS = {
+    'cpu': lambda entry: entry.cpu_percent or 0.0,
+    'rss': lambda entry: entry.rss,
+    'io': lambda entry: entry.io_rate or 0.0,
+    'threads': lambda entry: entry.num_threads,
+    'age': lambda entry: -entry.create_time,
+}
+
+_separators = re.compile(r'[\s/\\=:,;"\']+')
+
+
+def tokenize(text) -> list[str]:
+    return [token for token in _separators.split(text.lower()) if token]
+
+
+class ProcessEntry:
+    __slots__ = ('pid', 'ppid', 'name', 'args', 'cmdline', 'search_text', 'create_time', 'username', 'process', 'tokens',
+                 'status', 'rss', 'num_threads', 'cpu_percent', 'io_rate', '_cpu_time', '_io_bytes', '_sampled_at')
+
+    def __init__(self, process):
+        with process.oneshot():
+            self.pid = process.pid
+            self.create_time = process.create_time()
+            self.ppid = process.ppid()
+            self.name = process.name()
+            try:
+                self.args = process.cmdline()
+            except (psutil.AccessDenied, psutil.ZombieProcess):
+                self.args = []
+            try:
+                self.username = process.username()
+            except (psutil.AccessDenied, KeyError): # KeyError: uid 没有对应的用户
+                self.username = ''
+        self.cmdline = ' '.join(self.args) or self.name
+        self.search_text = self.cmdline.lower()
+        self.process = process # 复用同一个 psutil.Process，cpu_percent 等需要前后两次采样的值才有意义
+        self.tokens = frozenset(tokenize(self.search_text))
+        self.status = ''
+        self.rss = 0
+        self.num_threads = 0
+        self.cpu_percent = None # 第二次采样后才有值
+        self.io_rate = None # 读写字节/秒，没有权限或平台不支持时为 None
+        self._cpu_time = None
+        self._io_bytes = None
+        self._sampled_at = None
+
+    def sample(self, now):
+        '''采样资源占用，和上一次采样比较得出 CPU% 和 IO 速率'''
+        process = self.process
+        with process.oneshot():
+            cpu = process.cpu_times()
+            self.ppid = process.ppid() # 父进程退出后会被重新挂到其它进程下
+            self.status = process.status()
+            self.rss = process.memory_info().rss
+            self.num_threads = process.num_threads()
+            try:
+                io = process.io_counters()
+                io_bytes = io.read_bytes + io.write_bytes
+            except (psutil.AccessDenied, AttributeError): # macOS 没有 io_counters
+                io_bytes = None
+        cpu_time = cpu.user + cpu.system
+        if self._sampled_at is not None and now > self._sampled_at:
+            elapsed = now - self._sampled_at
+            self.cpu_percent = round(max(cpu_time - self._cpu_time, 0) / elapsed * 100, 1)
+            if io_bytes is not None and self._io_bytes is not None:
+                self.io_rate = round(max(io_bytes - self._io_bytes, 0) / elapsed, 1)
+        self._cpu_time = cpu_time
+        self._io_bytes = io_bytes
+        self._sampled_at = now
+
+
+def _gone(process) -> bool:
+    '''进程已退出，或只剩下等待别的父进程回收的僵尸进程'''
+    try:
+        return process.status() == psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return True
+
+
+def _wait_gone(processes, timeout) -> tuple[list, list]:
+    '''在同一个期限内一起等待所有进程退出，返回 (已退出, 仍在运行)'''
+    deadline = time.monotonic() + timeout
+    alive = list(processes)
+    gone = []
+    while True:
+        running = []
+        for process in alive:
+            (gone if _gone(process) else running).append(process)
+        alive = running
+        if not alive or time.monotonic() >= deadline:
+            return gone, alive
+        time.sleep(min(WAIT_INTERVAL, max(deadline - time.monotonic(), 0)))
+
+
+def terminate_processes(pids, timeout=5, table=None) -> dict[int, str]:
+    '''
+    批量结束进程: 先同时给所有进程发送 SIGTERM，在同一个期限内一起等待，到期仍未退出的再发送 SIGKILL
+    全部在本进程内通过 psutil 完成，不为每个 pid 启动 kill / taskkill 子进程
+    返回每个 pid 的结果: terminated / killed / no such process / access denied / still running
+    '''
+    results = {}
+    processes = []
+    for pid in pids:
+        # 优先使用进程表中的 psutil.Process，pid 已被新进程复用时会报告 NoSuchProcess 而不会误杀
+        entry = table.get(pid) if table is not None else None
+        try:
+            process = entry.process if entry is not None else psutil.Process(pid)
+            process.terminate()
+            processes.append(process)
+        except psutil.NoSuchProcess:
+            results[pid] = 'no such process'
+        except psutil.AccessDenied:
+            results[pid] = 'access denied'
+
+    gone, alive = _wait_gone(processes, timeout)
+    for process in gone:
+        results[process.pid] = 'terminated'
+    killed = []
+    for process in alive:
+        try:
+            process.kill()
+            killed.append(process)
+        except psutil.NoSuchProcess:
+            results[process.pid] = 'terminated'
+        except psutil.AccessDenied:
+            results[process.pid] = 'access denied'
+
+    gone, alive = _wait_gone(killed, KILL_TIMEOUT)
+    for process in gone:
+        results[process.pid] = 'killed'
+    for process in alive:
+        results[process.pid] = 'still running'
+    return {pid: results[pid] for pid in pids}
+
+
+class ProcessTable:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.entries = {} # pid -> ProcessEntry
+        self._index = {} # 命令行中的词 -> pid 集合
+        self._substrings = {} # 查询词 -> 包含它的索引词，词表变化时清空
+        self.updated_at = 0
+        self.samples = 0 # 连续采样的次数，至少两次后才有 CPU%
+        self._interval = REFRESH_INTERVAL # 进程很多、刷新一次很慢时自动拉长间隔
+        self._queried_at = 0
+        self._rates_queried_at = 0 # 最近一次需要 CPU% / IO 速率的查询，IDLE_TIMEOUT 内刷新时才采样
+        self._thread = None
+
+    def _add(self, entry):
+        self.entries[entry.pid] = entry
+        for token in entry.tokens:
+            pids = self._index.get(token)
+            if pids is None:
+                pids = self._index[token] = set()
+                self._substrings.clear()
+            pids.add(entry.pid)
+
+    def _remove(self, pid):
+        entry = self.entries.pop(pid)
+        for token in entry.tokens:
+            pids = self._index[token]
+            pids.discard(pid)
+            if not pids:
+                del self._index[token]
+                self._substrings.clear()
+
+    def refresh(self):
+        '''
+        比较 pid 集合的差异更新进程表；最近有查询需要 CPU% / IO 速率时才给所有进程采样，
+        只按命令行搜索时不逐个读取已有进程的信息
+        '''
+        started = time.monotonic()
+        sample = time.time() - self._rates_queried_at < IDLE_TIMEOUT
+        pids = set(psutil.pids())
+        with self._lock:
+            # 已退出的进程，以及 (采样时检查) pid 被新进程复用的进程
+            dead = [pid for pid, entry in self.entries.items()
+                    if pid not in pids or (sample and not entry.process.is_running())]
+            for pid in dead:
+                self._remove(pid)
+            new = pids - self.entries.keys()
+            existing = list(self.entries.values())
+        entries = []
+        for pid in new:
+            try:
+                entries.append(ProcessEntry(psutil.Process(pid)))
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                pass
+        now = time.monotonic()
+        for entry in (existing + entries) if sample else ():
+            try:
+                entry.sample(now)
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                pass # 退出的进程下次刷新时删除
+        with self._lock:
+            for entry in entries:
+                if entry.pid not in self.entries:
+                    self._add(entry)
+            self.updated_at = time.time()
+            # 连续采样的次数，中断过采样时上一次采样已经太旧，要重新采样两次
+            self.samples = self.samples + 1 if sample else 0
+        self._interval = max(REFRESH_INTERVAL, (time.monotonic() - started) * 2)
+
+    def _run(self):
+        while time.time() - self._queried_at < IDLE_TIMEOUT:
+            time.sleep(self._interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Process table refresh failed: {e}")
+        self._thread = None
+
+    def ensure_fresh(self, rates=False):
+        '''
+        查询前调用: 表过期时同步刷新一次，并确保后台刷新线程在运行
+        rates: 需要 CPU% / IO 速率时，第一次查询会间隔 FIRST_SAMPLE_DELAY 秒再采样一次
+        '''
+        self._queried_at = time.time()
+        if rates:
+            self._rates_queried_at = self._queried_at
+        if self._queried_at - self.updated_at > self._interval:
+            self.refresh()
+        while rates and self.samples < 2:
+            if self.samples:
+                time.sleep(FIRST_SAMPLE_DELAY)
+            self.refresh()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='process-table', daemon=True)
+            self._thread.start()
+
+    def _token_pids(self, query_token) -> set[int]:
+        '''命令行中包含 query_token (作为某个词的子串) 的进程'''
+        tokens = self._substrings.get(query_token)
+        if tokens is None:
+            tokens = self._substrings[query_token] = [token for token in self._index if query_token in token]
+        pids = set()
+        for token in tokens:
+            pids.update(self._index[token])
+        return pids
+
+    def search(self, command) -> list[int]:
+        '''
+        返回命令行中包含 command 的进程 (不区分大小写)，command 为空时返回所有进程
+        先用倒排索引求出候选进程，再逐个确认命令行包含整个 command
+        '''
+        self.ensure_fresh()
+        needle = command.lower()
+        with self._lock:
+            tokens = sorted(set(tokenize(command)), key=len, reverse=True)
+            if not tokens:
+                candidates = self.entries.keys()
+            else:
+                candidates = None
+                for token in tokens: # 长的词命中的进程通常更少，先求交集
+                    pids = self._token_pids(token)
+                    candidates = pids if candidates is None else candidates & pids
+                    if not candidates:
+                        return []
+            return sorted(pid for pid in candidates if needle in self.entries[pid].search_text)
+
+    def get(self, pid) -> ProcessEntry | None:
+        with self._lock:
+            return self.entries.get(pid)
+
+    def children_index(self, fresh=False) -> dict[int, list[int]]:
+        '''
+        一次遍历建立 ppid -> 子进程 pid 列表的索引，不需要对每个进程调用 children(recursive=True)
+        fresh: 不用缓存的进程表，直接读取当前所有进程的 ppid (结束进程树前使用，避免漏掉刚启动的子进程)
+        '''
+        children = {}
+        if fresh:
+            for process in psutil.process_iter(['ppid']):
+                children.setdefault(process.info['ppid'], []).append(process.pid)
+        else:
+            with self._lock:
+                for entry in self.entries.values():
+                    children.setdefault(entry.ppid, []).append(entry.pid)
+        return children
+
+    def subtree(self, pid, fresh=False) -> list[int]:
+        '''pid 及其所有子孙进程，父进程排在子进程前面'''
+        children = self.children_index(fresh)
+        result = []
+        seen = set()
+        stack = [pid]
+        while stack:
+            pid = stack.pop()
+            if pid in seen: # pid 0 的 ppid 是自己
+                continue
+            seen.add(pid)
+            result.append(pid)
+            stack.extend(reversed(children.get(pid, ())))
+        return result
+
+    def signal_tree(self, pid, sig) -> dict[int, str]:
+        '''给 pid 及其所有子孙进程发送信号，父进程先收到，返回每个进程的结果'''
+        results = {}
+        for pid in self.subtree(pid, fresh=True):
+            try:
+                psutil.Process(pid).send_signal(sig)
+                results[pid] = 'signalled'
+            except psutil.NoSuchProcess:
+                results[pid] = 'no such process'
+            except psutil.AccessDenied:
+                results[pid] = 'access denied'
+        return results
+
+    def tree(self, root=None) -> list[dict]:
+        '''
+        返回进程树 (父进程不在表中的进程作为根)，root 为 pid 时只返回以它为根的子树
+        每个节点带有整个子树的 CPU%、RSS 和进程数: tree_cpu_percent / tree_rss / tree_count
+        '''
+        self.ensure_fresh(rates=True)
+        with self._lock:
+            entries = list(self.entries.values())
+        nodes = {}
+        for entry in sorted(entries, key=lambda entry: entry.pid):
+            nodes[entry.pid] = {
+                "pid": entry.pid,
+                "ppid": entry.ppid,
+                "name": entry.name,
+                "username": entry.username,
+                "status": entry.status,
+                "cpu_percent": entry.cpu_percent,
+                "rss": entry.rss,
+                "cmdline": entry.cmdline,
+                "children": [],
+            }
+        roots = []
+        for pid, node in nodes.items():
+            parent = nodes.get(node["ppid"])
+            if parent is None or parent is node:
+                roots.append(node)
+            else:
+                parent["children"].append(node)
+        if root is not None:
+            roots = [nodes[root]] if root in nodes else []
+
+        # 先序遍历后倒序处理，子节点总在父节点之前汇总完
+        order = []
+        stack = list(roots)
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(node["children"])
+        for node in reversed(order):
+            node["tree_cpu_percent"] = round((node["cpu_percent"] or 0)
+                                             + sum(child["tree_cpu_percent"] for child in node["children"]), 1)
+            node["tree_rss"] = node["rss"] + sum(child["tree_rss"] for child in node["children"])
+            node["tree_count"] = 1 + sum(child["tree_count"] for child in node["children"])
+        return roots
+
+    def query(self, sort='cpu', reverse=True, limit=100, cursor=None, command='', user=None, name=None,
+             pids=None) -> tuple[list[ProcessEntry], int, tuple | None]:
+        '''
+        过滤并排序进程，返回 (当前页, 匹配的总数, 下一页的游标)
+        sort: SORT_KEYS 中的字段; reverse: 从大到小
+        cursor: 上一页最后一条的 (排序值, pid)，只返回排在它之后的进程，翻页期间进程增减不会重复或遗漏
+        command / user / name / pids: 命令行子串、用户名、进程名子串 (不区分大小写)、限定的 pid 集合
+        只用堆取出前 limit 条，不对所有匹配的进程排序
+        '''
+        self.ensure_fresh(rates=True)
+        value = SORT_KEYS[sort]
+        if reverse: # 统一成从小到大比较 (-值, pid)
+            key = lambda entry: (-value(entry), entry.pid)
+            after = None if cursor is None else (-cursor[0], cursor[1])
+        else:
+            key = lambda entry: (value(entry), entry.pid)
+            after = cursor
+        candidates = self.search(command) if command else None
+        name = name.lower() if name else None
+        with self._lock:
+            entries = self.entries.values() if candidates is None else \
+                [self.entries[pid] for pid in candidates if pid in self.entries]
+            matched = [entry for entry in entries
+                       if (pids is None or entry.pid in pids)
+                       and (not user or entry.username == user)
+                       and (not name or name in entry.name.lower())]
+        total = len(matched)
+        if after is not None:
+            matched = [entry for entry in matched if key(entry) > after]
+        page = heapq.nsmallest(limit + 1, matched, key=key)
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = (value(page[-1]), page[-1].pid)
+        return page, total, next_cursor
+
+
+process_table = ProcessTable()
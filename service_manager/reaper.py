@@ -0,0 +1,118 @@
+'''
+统一等待所有服务子进程退出的回收器
+
+以前每启动一个服务就开一个线程阻塞在 proc.wait() 上，几百个服务就是几百个空闲线程。
+这里只用一个后台线程: Linux (5.3+) 下为每个子进程打开 pidfd 放进 selector 统一等待，
+进程退出时 pidfd 变为可读；其它平台退回到在同一个线程里定期 poll() 所有子进程。
+'''
+import os
+import selectors
+import threading
+import time
+
+POLL_INTERVAL = 0.5 # 不支持 pidfd 时轮询的间隔(秒)
+
+
+class ChildReaper:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._use_pidfd = hasattr(os, 'pidfd_open')
+        self._selector = selectors.DefaultSelector() if self._use_pidfd else None
+        self._polled = {} # pid -> (proc, callback)，不支持 pidfd 时使用
+        self._wakeup = threading.Event()
+        self._wake_r = self._wake_w = None
+        if self._use_pidfd:
+            # 新增监视对象时写入该管道唤醒 select
+            self._wake_r, self._wake_w = os.pipe()
+            os.set_blocking(self._wake_r, False)
+            self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._thread = None
+
+    def watch(self, proc, callback):
+        '''
+        进程退出并被回收后，在回收线程中调用 callback(proc)
+        '''
+        if self._use_pidfd:
+            try:
+                fd = os.pidfd_open(proc.pid)
+            except ProcessLookupError: # 已经被回收了
+                proc.poll()
+                callback(proc)
+                return
+            except OSError: # 内核不支持 pidfd
+                self._use_pidfd = False
+            else:
+                with self._lock:
+                    self._selector.register(fd, selectors.EVENT_READ, (proc, callback))
+                os.write(self._wake_w, b'\0')
+                self._ensure_thread()
+                return
+        with self._lock:
+            self._polled[proc.pid] = (proc, callback)
+        self._wakeup.set()
+        self._ensure_thread()
+
+    def watched_count(self) -> int:
+        with self._lock:
+            count = len(self._polled)
+            if self._selector is not None:
+                count += len(self._selector.get_map()) - 1
+        return count
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='child-reaper', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._run_once()
+            except Exception as e:
+                print(f"Child reaper error: {e}")
+                time.sleep(POLL_INTERVAL)
+
+    def _drain_wakeup(self):
+        try:
+            os.read(self._wake_r, 4096)
+        except BlockingIOError:
+            pass
+
+    def _wait(self):
+        '''阻塞到有子进程退出或新增了监视对象，返回已退出的 [(proc, callback)]'''
+        exited = []
+        # 有轮询对象时不能无限阻塞
+        timeout = POLL_INTERVAL if self._polled else None
+        if self._selector is not None:
+            for key, _ in self._selector.select(timeout):
+                if key.data is None:
+                    self._drain_wakeup()
+                    continue
+                with self._lock:
+                    self._selector.unregister(key.fd)
+                os.close(key.fd)
+                exited.append(key.data)
+        else:
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+        if self._polled:
+            with self._lock:
+                items = list(self._polled.items())
+            for pid, (proc, callback) in items:
+                if proc.poll() is not None:
+                    with self._lock:
+                        self._polled.pop(pid, None)
+                    exited.append((proc, callback))
+        return exited
+
+    def _run_once(self):
+        for proc, callback in self._wait():
+            proc.wait() # 回收僵尸进程，pidfd 可读时会立即返回
+            try:
+                callback(proc)
+            except Exception as e:
+                print(f"Exit callback for PID {proc.pid} failed: {e}")
+
+reaper = ChildReaper()
@@ -0,0 +1,144 @@
+'''
+基于 SQLite (WAL 模式) 的服务注册表
+
+保存服务定义、当前状态、状态变化记录和退出历史。
+/services 直接查询 services 表，不再遍历服务对象逐个计算状态；多个服务的定义在一个事务中更新，要么全部生效要么都不生效。
+services/ 目录下的 JSON 文件仍然是可以直接编辑的配置，配置目录的变化以事务的方式同步到注册表。
+'''
+import json
+import os
+import sqlite3
+import threading
+import time
+
+HISTORY_LIMIT = 1000 # 每个服务保留的状态变化和退出记录条数
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS services (
+    name TEXT PRIMARY KEY,
+    config TEXT NOT NULL,
+    enabled INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'not started',
+    pid INTEGER,
+    started_at REAL,
+    exit_code INTEGER,
+    exited_at REAL,
+    next_restart_at REAL,
+    restarts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS services_state ON services (state, name);
+CREATE TABLE IF NOT EXISTS transitions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    state TEXT NOT NULL,
+    pid INTEGER,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transitions_name ON transitions (name, id);
+CREATE TABLE IF NOT EXISTS exits (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    pid INTEGER,
+    exit_code INTEGER,
+    started_at REAL,
+    exited_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS exits_name ON exits (name, id);
+'''
+
+STATE_COLUMNS = ('pid', 'started_at', 'exit_code', 'exited_at', 'next_restart_at', 'restarts')
+
+
+class ServiceRegistry:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        # 所有线程共用一个连接，由锁串行化；WAL 模式下外部的只读连接不会被写事务阻塞
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+
+    def sync(self, configs, removed=(), replace=False):
+        '''
+        在一个事务中写入服务定义 {name: config}，删除 removed 中的服务
+        replace: 删除所有不在 configs 中的服务 (启动时按配置目录全量同步)
+        '''
+        now = time.time()
+        with self._lock, self._conn:
+            if replace:
+                names = set(configs)
+                removed = [row['name'] for row in self._conn.execute('SELECT name FROM services')
+                           if row['name'] not in names]
+            self._conn.executemany('DELETE FROM services WHERE name = ?', [(name,) for name in removed])
+            self._conn.executemany(
+                '''INSERT INTO services (name, config, enabled, updated_at) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (name) DO UPDATE SET config = excluded.config, enabled = excluded.enabled,
+                   updated_at = excluded.updated_at''',
+                [(name, json.dumps(config, ensure_ascii=False), int(bool(config.get('is_enabled'))), now)
+                 for name, config in configs.items()])
+
+    def reset_states(self):
+        '''启动时调用: 上次运行留下的进程状态已经无效'''
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE services SET state = 'not started', pid = NULL, next_restart_at = NULL")
+
+    def _prune(self, table, name):
+        '''只保留服务最近的 HISTORY_LIMIT 条记录，按 (name, id) 索引定位边界'''
+        self._conn.execute(
+            f'''DELETE FROM {table} WHERE name = ? AND id < (
+                    SELECT id FROM {table} WHERE name = ? ORDER BY id DESC LIMIT 1 OFFSET ?)''',
+            (name, name, HISTORY_LIMIT - 1))
+
+    def record_state(self, name, state, **values):
+        '''更新服务的当前状态 (values 为 STATE_COLUMNS 中的列)，并记录一次状态变化'''
+        columns = [column for column in values if column in STATE_COLUMNS]
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                f'''UPDATE services SET state = ?, updated_at = ?{''.join(f', {column} = ?' for column in columns)}
+                    WHERE name = ?''',
+                [state, now, *(values[column] for column in columns), name])
+            self._conn.execute('INSERT INTO transitions (name, state, pid, at) VALUES (?, ?, ?, ?)',
+                               (name, state, values.get('pid'), now))
+            self._prune('transitions', name)
+
+    def record_exit(self, name, pid, exit_code, started_at, exited_at):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT INTO exits (name, pid, exit_code, started_at, exited_at) VALUES (?, ?, ?, ?, ?)',
+                               (name, pid, exit_code, started_at, exited_at))
+            self._prune('exits', name)
+
+    def services(self, state=None) -> list[sqlite3.Row]:
+        '''按名称排序的所有服务，state 为状态时只返回该状态的服务 (走 services_state 索引)'''
+        with self._lock:
+            if state:
+                return self._conn.execute('SELECT * FROM services WHERE state = ? ORDER BY name', (state,)).fetchall()
+            return self._conn.execute('SELECT * FROM services ORDER BY name').fetchall()
+
+    def history(self, name, limit=100) -> dict:
+        '''最近的状态变化和退出记录，新的在前'''
+        with self._lock:
+            transitions = self._conn.execute(
+                'SELECT state, pid, at FROM transitions WHERE name = ? ORDER BY id DESC LIMIT ?', (name, limit))
+            exits = self._conn.execute(
+                'SELECT pid, exit_code, started_at, exited_at FROM exits WHERE name = ? ORDER BY id DESC LIMIT ?',
+                (name, limit))
+            return {
+                "transitions": [dict(row) for row in transitions],
+                "exits": [dict(row) for row in exits],
+            }
+
+    def export(self) -> dict:
+        '''所有服务的定义 {name: config}'''
+        with self._lock:
+            return {row['name']: json.loads(row['config'])
+                    for row in self._conn.execute('SELECT name, config FROM services ORDER BY name')}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
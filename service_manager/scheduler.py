@@ -0,0 +1,66 @@
+'''
+基于最小堆的定时器，用于服务的延迟重启
+
+所有定时任务放在一个堆里，由一个后台线程等待最早到期的任务，
+不会为每个等待重启的服务各开一个 sleep 线程；取消只做标记，到期时跳过。
+'''
+import heapq
+import itertools
+import threading
+import time
+
+
+class Timer:
+    __slots__ = ('when', 'fn', 'cancelled')
+
+    def __init__(self, when, fn):
+        self.when = when
+        self.fn = fn
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    def __init__(self):
+        self._heap = [] # (到期时间, 序号, Timer)
+        self._counter = itertools.count() # 到期时间相同时按加入顺序执行
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def call_later(self, delay, fn) -> Timer:
+        '''delay 秒后在调度线程中调用 fn()，返回可以 cancel() 的 Timer'''
+        timer = Timer(time.monotonic() + delay, fn)
+        with self._cond:
+            heapq.heappush(self._heap, (timer.when, next(self._counter), timer))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+                self._thread.start()
+            # 只有新任务成为最早到期的任务时才需要唤醒
+            if self._heap[0][2] is timer:
+                self._cond.notify()
+        return timer
+
+    def pending(self) -> int:
+        with self._cond:
+            return sum(1 for _, _, timer in self._heap if not timer.cancelled)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][2].cancelled or self._heap[0][0] > time.monotonic():
+                    if self._heap and self._heap[0][2].cancelled:
+                        heapq.heappop(self._heap)
+                    elif self._heap:
+                        self._cond.wait(self._heap[0][0] - time.monotonic())
+                    else:
+                        self._cond.wait()
+                _, _, timer = heapq.heappop(self._heap)
+            try:
+                timer.fn()
+            except Exception as e:
+                print(f"Scheduled task failed: {e}")
+
+
+scheduler = Scheduler()
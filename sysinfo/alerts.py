@@ -0,0 +1,228 @@
+"""
+基于采样流的告警引擎
+
+每次采样对每条规则做一次 O(1) 摊销的增量计算 (只维护该规则时间窗口内的样本)，从不回扫历史数据。
+规则支持持续时间 (for)、恢复阈值 (clear，用于迟滞) 和重复提醒间隔 (repeat)，
+同一告警在恢复之前只通知一次。通知通过日志文件、webhook 或命令发出，在后台 greenlet 中执行，不阻塞采样。
+
+规则配置 (alerts.json):
+{
+    "rules": [
+        {"name": "cpu_high", "metric": "cpu_usage", "op": ">", "threshold": 90, "for": 60, "clear": 80},
+        {"name": "disk_full", "metric": "disk.percent", "op": ">", "threshold": 95, "actions": ["log", "hook"]},
+        {"name": "test_flapping", "metric": "services.test.restarts", "type": "increase", "window": 300, "op": ">=", "threshold": 3}
+    ],
+    "actions": {
+        "log": {"type": "log", "path": "alerts.log"},
+        "hook": {"type": "webhook", "url": "http://127.0.0.1:9000/alert"},
+        "notify": {"type": "command", "cmd": "echo $ALERT_NAME $ALERT_STATE"}
+    }
+}
+metric 为采样结果中的字段路径，嵌套字段和列表下标用 . 分隔 (如 load_avg.0)。
+type: value (默认，直接比较当前值) / rate (窗口内每秒变化量) / increase (窗口内的增量)
+"""
+import datetime
+import json
+import operator
+import os
+import subprocess
+import time
+import urllib.request
+from collections import deque
+
+import gevent
+
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+RULE_TYPES = ("value", "rate", "increase")
+
+
+def resolve_metric(info, path):
+    value = info
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part)
+        elif isinstance(value, (list, tuple)) and part.isdecimal() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return None
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class AlertRule:
+    def __init__(self, name, metric, op, threshold, type="value", window=60, clear=None, repeat=0,
+                 actions=None, **kwargs):
+        # for 是 Python 关键字，只能通过 kwargs 传入；其它未知的键多半是拼错了，直接报错而不是静默忽略
+        unknown = set(kwargs) - {"for"}
+        if unknown:
+            raise ValueError(f"Alert rule {name}: unknown keys {', '.join(sorted(unknown))}")
+        if not isinstance(metric, str) or not metric:
+            raise ValueError(f"Alert rule {name}: metric must be a non-empty string")
+        if op not in OPERATORS:
+            raise ValueError(f"Alert rule {name}: unknown op {op}")
+        if type not in RULE_TYPES:
+            raise ValueError(f"Alert rule {name}: unknown type {type}")
+        if not _is_number(threshold):
+            raise ValueError(f"Alert rule {name}: threshold must be a number")
+        if clear is not None and not _is_number(clear):
+            raise ValueError(f"Alert rule {name}: clear must be a number")
+        if not _is_number(window) or window <= 0:
+            raise ValueError(f"Alert rule {name}: window must be a positive number")
+        for key, value in (("for", kwargs.get("for", 0)), ("repeat", repeat)):
+            if not _is_number(value) or value < 0:
+                raise ValueError(f"Alert rule {name}: {key} must be a non-negative number")
+        if actions is not None and not (isinstance(actions, list) and all(isinstance(a, str) for a in actions)):
+            raise ValueError(f"Alert rule {name}: actions must be a list of action names")
+        self.name = name
+        self.metric = metric
+        self.op = op
+        self.threshold = threshold
+        self.type = type
+        self.window = window
+        self.duration = kwargs.get("for", 0)  # 条件需要持续满足的秒数
+        self.clear = threshold if clear is None else clear  # 恢复阈值，不满足 op clear 时才恢复
+        self.repeat = repeat  # 持续告警时的重复提醒间隔，0 表示不重复
+        self.actions = actions
+
+        self.samples = deque()  # rate/increase 规则窗口内的 (时间, 值)
+        self.value = None
+        self.pending_since = None
+        self.firing = False
+        self.fired_at = None
+        self.notified_at = None
+
+    def observe(self, value, now):
+        """把新的样本折算成规则要比较的值"""
+        if self.type == "value":
+            return value
+        samples = self.samples
+        samples.append((now, value))
+        while len(samples) > 1 and samples[0][0] < now - self.window:
+            samples.popleft()
+        first_time, first_value = samples[0]
+        if self.type == "increase":
+            return max(value - first_value, 0)
+        return (value - first_value) / (now - first_time) if now > first_time else 0.0
+
+    def evaluate(self, info, now):
+        """
+        返回需要发出的通知状态: "firing" / "resolved" / None
+        """
+        raw = resolve_metric(info, self.metric)
+        if raw is None:
+            return None
+        self.value = value = self.observe(raw, now)
+        compare = OPERATORS[self.op]
+
+        if not self.firing:
+            if not compare(value, self.threshold):
+                self.pending_since = None
+                return None
+            if self.pending_since is None:
+                self.pending_since = now
+            if now - self.pending_since < self.duration:
+                return None
+            self.firing = True
+            self.fired_at = self.notified_at = now
+            return "firing"
+
+        if not compare(value, self.clear):
+            self.firing = False
+            self.pending_since = None
+            return "resolved"
+        if self.repeat and now - self.notified_at >= self.repeat:
+            self.notified_at = now
+            return "firing"
+        return None
+
+    def state(self):
+        return {
+            "name": self.name,
+            "metric": self.metric,
+            "condition": f"{self.type}({self.metric}) {self.op} {self.threshold}",
+            "value": self.value,
+            "state": "firing" if self.firing else ("pending" if self.pending_since is not None else "ok"),
+            "fired_at": self.fired_at if self.firing else None,
+        }
+
+
+class AlertEngine:
+    def __init__(self, rules=(), actions=None, base_dir="."):
+        self.rules = list(rules)
+        self.actions = actions or {"log": {"type": "log", "path": "alerts.log"}}
+        self.base_dir = base_dir
+
+    @classmethod
+    def load(cls, path):
+        """从 JSON 配置文件加载规则，文件不存在时返回没有规则的引擎"""
+        base_dir = os.path.dirname(os.path.abspath(path))
+        if not os.path.isfile(path):
+            return cls(base_dir=base_dir)
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        rules = [AlertRule(**rule) for rule in config.get("rules", [])]
+        engine = cls(rules, config.get("actions"), base_dir)
+        for rule in rules:
+            for action in rule.actions or ():
+                if action not in engine.actions:
+                    raise ValueError(f"Alert rule {rule.name}: unknown action {action}")
+        return engine
+
+    def evaluate(self, info, now=None):
+        now = time.time() if now is None else now
+        for rule in self.rules:
+            # 单条规则出错不影响其它规则，也不能中断采样和推送
+            try:
+                state = rule.evaluate(info, now)
+                if state is not None:
+                    self.notify(rule, state, now)
+            except Exception as e:
+                print(f"[alert] Evaluating rule {rule.name} failed: {e}")
+
+    def notify(self, rule, state, now):
+        event = {
+            "name": rule.name,
+            "state": state,
+            "metric": rule.metric,
+            "value": rule.value,
+            "condition": f"{rule.type}({rule.metric}) {rule.op} {rule.threshold}",
+            "time": datetime.datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        print(f"[alert] {event['time']} {rule.name} {state}: {event['condition']} (value: {rule.value})")
+        for name in rule.actions or list(self.actions):
+            gevent.spawn(self._run_action, self.actions[name], event)
+
+    def _run_action(self, action, event):
+        try:
+            kind = action.get("type")
+            if kind == "log":
+                path = os.path.join(self.base_dir, action.get("path", "alerts.log"))
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+            elif kind == "webhook":
+                request = urllib.request.Request(
+                    action["url"], data=json.dumps(event).encode("utf-8"),
+                    headers={"Content-Type": "application/json"}, method="POST",
+                )
+                urllib.request.urlopen(request, timeout=action.get("timeout", 5)).close()
+            elif kind == "command":
+                env = os.environ.copy()
+                env.update({f"ALERT_{k.upper()}": str(v) for k, v in event.items()})
+                subprocess.run(action["cmd"], shell=True, env=env, timeout=action.get("timeout", 30))
+            else:
+                print(f"[alert] Unknown action type: {kind}")
+        except Exception as e:
+            print(f"[alert] Action {action.get('type')} failed: {e}")
+
+    def states(self):
+        return [rule.state() for rule in self.rules]
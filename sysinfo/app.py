@@ -1,100 +1,1011 @@
 import datetime
 import platform
 import json
+import math
+import re
 import socket
 import time
 import os
+import sys
+import mmap
+import struct
+from array import array
 import psutil
 import cpuinfo
+import gevent.event
 import gevent.monkey
-from bottle import Bottle, request, abort, run, static_file
+from bottle import Bottle, request, response, abort, run, static_file
 from gevent.pywsgi import WSGIServer
 from geventwebsocket.handler import WebSocketHandler
 from geventwebsocket.exceptions import WebSocketError
 
+try:
+    from . import netstat
+    from .alerts import AlertEngine
+    from .process_cache import ProcessCache, TOP_SORT_KEYS
+except ImportError:  # 直接运行 app.py 时
+    import netstat
+    from alerts import AlertEngine
+    from process_cache import ProcessCache, TOP_SORT_KEYS
+
+try:
+    import msgpack  # 可选依赖，用于二进制帧编码
+except ImportError:
+    msgpack = None
+
 gevent.monkey.patch_all()
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 app = Bottle()
 
-# 存放所有活跃 WebSocket 连接
+# 存放所有活跃 WebSocket 连接 (SystemProbeWebSocket 实例)
 connected_websockets = set()
 
 
+def get_static_info():
+    """不会变化的系统信息，只在采样器启动时获取一次"""
+    cpu_info = cpuinfo.get_cpu_info()
+    bits, linkage = platform.architecture()
+    return {
+        "os": platform.system(),
+        "release": platform.release(),
+        "version": platform.version(),
+        "machine": platform.machine(),
+        "processor": cpu_info.get("brand_raw", "Unknown"),
+        "node": platform.node(),
+        "bits": bits,
+        "linkage": linkage,
+        "cpu_cores": psutil.cpu_count(logical=False),
+        "cpu_threads": psutil.cpu_count(logical=True),
+        "boot_time": int(psutil.boot_time()),
+        "ip_address": socket.gethostbyname(socket.gethostname()),
+    }
+
+
+class CounterRates:
+    """
+    保存上一次采样的累计计数器，把一组设备的所有计数器展平到一个 array 中，一次遍历算出每秒速率
+    """
+
+    def __init__(self):
+        self._prev = {}  # 分组 -> (设备名, 计数器 array, 采样时间)
+
+    def rates(self, group, counters, fields, timestamp):
+        """
+        counters: 设备名 -> psutil 计数器 namedtuple
+        返回 设备名 -> {字段: 每秒速率}，首次采样或设备列表变化时返回 None
+        """
+        names = tuple(counters)
+        values = array("d", (getattr(counters[name], field, 0) for name in names for field in fields))
+        prev = self._prev.get(group)
+        self._prev[group] = (names, values, timestamp)
+        if prev is None or prev[0] != names or timestamp <= prev[2]:
+            return None
+        elapsed = timestamp - prev[2]
+        deltas = [(cur - old) / elapsed if cur >= old else 0.0 for cur, old in zip(values, prev[1])]
+        width = len(fields)
+        return {
+            name: dict(zip(fields, deltas[i * width:(i + 1) * width]))
+            for i, name in enumerate(names)
+        }
+
+
+counter_rates = CounterRates()
+
+DISK_RATE_FIELDS = ("read_count", "write_count", "read_bytes", "write_bytes", "busy_time")
+NIC_RATE_FIELDS = ("bytes_recv", "bytes_sent", "packets_recv", "packets_sent")
+TOTAL_KEY = "_total"
+
+
+def disk_rate(rates):
+    return {
+        "read_iops": round(rates["read_count"], 2),
+        "write_iops": round(rates["write_count"], 2),
+        "read_bytes_per_sec": round(rates["read_bytes"]),
+        "write_bytes_per_sec": round(rates["write_bytes"]),
+        "busy_percent": round(min(rates["busy_time"] / 10, 100), 2),  # busy_time 单位为毫秒
+    }
+
+
+def nic_rate(rates):
+    return {
+        "rx_bytes_per_sec": round(rates["bytes_recv"]),
+        "tx_bytes_per_sec": round(rates["bytes_sent"]),
+        "rx_packets_per_sec": round(rates["packets_recv"], 2),
+        "tx_packets_per_sec": round(rates["packets_sent"], 2),
+    }
+
+
+def sample_cpu():
+    cpu_freq = psutil.cpu_freq()
+    return {
+        "cpu_usage": psutil.cpu_percent(),
+        "cpu_per_core": psutil.cpu_percent(percpu=True),
+        "cpu_freq": cpu_freq.current if cpu_freq else 0,
+        "load_avg": psutil.getloadavg() if hasattr(psutil, "getloadavg") else (0, 0, 0),
+    }
+
+
+def sample_memory():
+    return {
+        "memory": psutil.virtual_memory()._asdict(),
+        "swap": psutil.swap_memory()._asdict(),
+    }
+
+
+def sample_disk():
+    total = psutil.disk_io_counters()
+    counters = {
+        name: c for name, c in (psutil.disk_io_counters(perdisk=True) or {}).items()
+        if not name.startswith(("loop", "ram"))
+    }
+    counters[TOTAL_KEY] = total
+    rates = counter_rates.rates("disk", counters, DISK_RATE_FIELDS, time.time()) or {}
+    total_rate = rates.pop(TOTAL_KEY, None)
+    return {
+        "disk": psutil.disk_usage("/")._asdict(),
+        "disk_io": total._asdict(),
+        "disk_io_rate": disk_rate(total_rate) if total_rate else None,
+        "disks": {name: disk_rate(r) for name, r in rates.items()},
+    }
+
+
+def sample_network():
+    total = psutil.net_io_counters()
+    counters = dict(psutil.net_io_counters(pernic=True))
+    counters[TOTAL_KEY] = total
+    rates = counter_rates.rates("network", counters, NIC_RATE_FIELDS, time.time()) or {}
+    total_rate = rates.pop(TOTAL_KEY, None)
+    return {
+        "network": total._asdict(),
+        "network_rate": nic_rate(total_rate) if total_rate else None,
+        "nics": {name: nic_rate(r) for name, r in rates.items()},
+    }
+
+
+def sample_connections():
+    # Linux 下直接解析 /proc/net，其它平台退回 net_connections (会遍历所有 socket，在繁忙的机器上开销很大)
+    if netstat.is_supported():
+        stats = netstat.socket_stats()
+        return {
+            "tcp4_connection_count": stats["tcp4"]["total"],
+            "tcp6_connection_count": stats["tcp6"]["total"],
+            "socket_stats": stats,
+        }
+    return {
+        "tcp4_connection_count": len(psutil.net_connections(kind="tcp4")),
+        "tcp6_connection_count": len(psutil.net_connections(kind="tcp6")),
+    }
+
+
+def sample_processes():
+    return {
+        "process_count": len(psutil.pids()),
+    }
+
+
+# 服务进程的 psutil.Process 缓存 (pid -> Process)，跨采样复用
+service_procs = {}
+# 各服务上次采样到的 pid 和观察到的重启次数，用于告警规则 (services.<name>.restarts)
+service_pids = {}
+service_restarts = {}
+
+
+def sample_services():
+    """
+    采集 service_manager 所管理服务的进程指标
+    只有 service_manager 与 sysinfo 运行在同一进程 (main.py) 时才有数据，这里不主动导入它，避免重复启动服务
+    """
+    service_manager = sys.modules.get("service_manager.app")
+    if service_manager is None:
+        return {}
+    services = {}
+    alive = set()
+    for name, service in list(service_manager.services.items()):
+        entry = {"running": 0}
+        process = service.process
+        if process and process.poll() is None:
+            entry.update(running=1, pid=process.pid)
+            last_pid = service_pids.get(name)
+            if last_pid is not None and last_pid != process.pid:
+                service_restarts[name] = service_restarts.get(name, 0) + 1
+            service_pids[name] = process.pid
+            proc = service_procs.get(process.pid)
+            try:
+                if proc is None:
+                    proc = service_procs[process.pid] = psutil.Process(process.pid)
+                with proc.oneshot():
+                    cpu_times = proc.cpu_times()
+                    entry.update(
+                        cpu_seconds=cpu_times.user + cpu_times.system,
+                        rss=proc.memory_info().rss,
+                        num_threads=proc.num_threads(),
+                    )
+                alive.add(process.pid)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        # 服务自己记录的自动重启次数更准确: 采样间隔内多次重启时 pid 比较只能看到一次
+        restart_count = getattr(service, "restart_count", None)
+        entry["restarts"] = restart_count if restart_count is not None else service_restarts.get(name, 0)
+        # 有单独的 cgroup 时直接读取整个进程树的资源统计，包括脱离父进程的孙子进程
+        stats = service.cgroup_stats() if hasattr(service, "cgroup_stats") else None
+        if stats:
+            entry["cgroup"] = {
+                "cpu_seconds": stats["cpu_seconds"],
+                "memory_current": stats["memory_current"],
+                "pids_current": stats["pids_current"],
+                "io_read_bytes": (stats["io"] or {}).get("rbytes"),
+                "io_write_bytes": (stats["io"] or {}).get("wbytes"),
+            }
+        services[name] = entry
+    for pid in service_procs.keys() - alive:
+        del service_procs[pid]
+    return {"services": services}
+
+
+# 指标分组: 组名 -> 采样函数
+METRIC_GROUPS = {
+    "cpu": sample_cpu,
+    "memory": sample_memory,
+    "disk": sample_disk,
+    "network": sample_network,
+    "connections": sample_connections,
+    "processes": sample_processes,
+    "services": sample_services,
+}
+
+# 各分组的默认采样间隔(秒)，两次刷新之间复用缓存的最新值
+DEFAULT_INTERVALS = {
+    "cpu": 1,
+    "memory": 1,
+    "disk": 2,
+    "network": 2,
+    "connections": 15,
+    "processes": 10,
+    "services": 5,
+    "top": 2,  # top 进程表，只在有客户端订阅时刷新
+}
+
+
+def parse_intervals(text):
+    """
+    解析形如 "cpu=1,disk=5,connections=30" 的采样间隔配置
+    """
+    intervals = {}
+    for item in filter(None, (part.strip() for part in (text or "").split(","))):
+        group, _, value = item.partition("=")
+        group = group.strip()
+        if group not in DEFAULT_INTERVALS:
+            raise ValueError(f"Unknown metric group: {group}")
+        intervals[group] = max(float(value), 0.1)
+    return intervals
+
+
+def diff_frames(old, new):
+    """
+    返回 new 相对 old 变化的字段，嵌套的 dict 递归比较，被删除的字段以 None 表示
+    """
+    changes = {}
+    for key, value in new.items():
+        old_value = old.get(key)
+        if key in old and value == old_value:
+            continue
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            changes[key] = diff_frames(old_value, value)
+        else:
+            changes[key] = value
+    for key in old.keys() - new.keys():
+        changes[key] = None
+    return changes
+
+
+# 帧协议模式: full 每次发送完整快照; delta 连接时发送一次完整快照，之后只发送变化的字段
+FRAME_MODES = ("full", "delta")
+# 客户端可订阅的分组: static 为主机名、系统版本等不变的信息，其余与 METRIC_GROUPS 对应
+FRAME_GROUPS = ("static",) + tuple(METRIC_GROUPS)
+FRAME_ENCODINGS = ("json", "msgpack")
+TOP_MAX = 100  # top 进程表最多返回的进程数
+SEND_TIMEOUT = 30  # 单帧发送超过该秒数视为连接已卡死
+# 每帧都会携带的字段，与订阅的分组无关
+ALWAYS_SENT_KEYS = ("sample_times", "timestamp", "current_time", "time_zone")
+
+
+def encode_frame(data, encoding):
+    if encoding == "msgpack":
+        return msgpack.packb(data, use_bin_type=True)
+    return json.dumps(data)
+
+
+# 历史曲线保存的标量指标: 指标名 -> 从采样结果中取值的函数
+HISTORY_METRICS = {
+    "cpu_usage": lambda info: info.get("cpu_usage"),
+    "memory_percent": lambda info: info.get("memory", {}).get("percent"),
+    "swap_percent": lambda info: info.get("swap", {}).get("percent"),
+    "disk_percent": lambda info: info.get("disk", {}).get("percent"),
+    "load_1": lambda info: (info.get("load_avg") or (None,))[0],
+    "process_count": lambda info: info.get("process_count"),
+    "tcp4_connection_count": lambda info: info.get("tcp4_connection_count"),
+    "tcp6_connection_count": lambda info: info.get("tcp6_connection_count"),
+    "net_recv_rate": lambda info: (info.get("network_rate") or {}).get("rx_bytes_per_sec"),
+    "net_sent_rate": lambda info: (info.get("network_rate") or {}).get("tx_bytes_per_sec"),
+    "disk_read_rate": lambda info: (info.get("disk_io_rate") or {}).get("read_bytes_per_sec"),
+    "disk_write_rate": lambda info: (info.get("disk_io_rate") or {}).get("write_bytes_per_sec"),
+}
+
+# 历史分辨率: (步长秒数, 保留的点数)，即 1s x 10分钟, 10s x 6小时, 1min x 7天
+HISTORY_RESOLUTIONS = [(1, 600), (10, 2160), (60, 10080)]
+
+# 历史数据持久化目录，以及各分辨率在磁盘上保留的时长(秒)
+HISTORY_DATA_DIR = os.environ.get("SYSINFO_DATA_DIR") or os.path.join(script_dir, "data")
+HISTORY_RETENTION = {1: 3600, 10: 2 * 86400, 60: 30 * 86400}
+
+# 告警规则配置文件
+ALERTS_CONFIG = os.environ.get("SYSINFO_ALERTS") or os.path.join(script_dir, "alerts.json")
+
+
+def parse_duration(text):
+    """
+    解析 "600"、"10m"、"6h"、"7d" 形式的时长，返回秒数
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*", text or "")
+    if not match:
+        raise ValueError(f"Invalid duration: {text}")
+    value, unit = match.groups()
+    return float(value) * {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}[unit]
+
+
+class RingSeries:
+    """
+    一个分辨率下的历史数据: 固定大小、基于 array 的环形缓冲区
+    原始样本按步长分桶累加，桶结束时把平均值写入缓冲区，降采样是增量完成的
+    """
+
+    def __init__(self, step, capacity, metrics, store=None):
+        self.step = step
+        self.capacity = capacity
+        self.metrics = list(metrics)
+        self.store = store  # 可选的 MetricsStore，写入缓冲区的点同时追加到磁盘
+        self.times = array("d", bytes(8 * capacity))
+        self.values = {name: array("d", bytes(8 * capacity)) for name in self.metrics}
+        self.head = 0   # 下一个写入位置
+        self.count = 0  # 已写入的点数
+        self._bucket = None
+        self._sums = dict.fromkeys(self.metrics, 0.0)
+        self._counts = dict.fromkeys(self.metrics, 0)
+
+    def add(self, timestamp, values):
+        bucket = int(timestamp // self.step)
+        if self._bucket is not None and bucket != self._bucket:
+            self._flush()
+        self._bucket = bucket
+        for name, value in values.items():
+            if value is not None:
+                self._sums[name] += value
+                self._counts[name] += 1
+
+    def _flush(self):
+        timestamp = self._bucket * self.step
+        values = []
+        for name in self.metrics:
+            n = self._counts[name]
+            values.append(self._sums[name] / n if n else math.nan)
+            self._sums[name] = 0.0
+            self._counts[name] = 0
+        self._put(timestamp, values)
+        if self.store is not None:
+            try:
+                self.store.append(timestamp, values)
+            except OSError as e:
+                print(f"[sysinfo] Failed to persist history: {e}")
+
+    def _put(self, timestamp, values):
+        i = self.head
+        self.times[i] = timestamp
+        for name, value in zip(self.metrics, values):
+            self.values[name][i] = value
+        self.head = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def load(self, records):
+        """用磁盘上的历史记录预先填充缓冲区"""
+        for record in records:
+            self._put(record[0], record[1:])
+
+    def _ordered(self, data):
+        """按时间顺序返回环形缓冲区中的数据"""
+        if self.count < self.capacity:
+            return data[:self.count]
+        return data[self.head:] + data[:self.head]
+
+    def query(self, metrics, since):
+        times = self._ordered(self.times)
+        # times 是递增的，二分查找起点
+        lo, hi = 0, len(times)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if times[mid] < since:
+                lo = mid + 1
+            else:
+                hi = mid
+        return {
+            "times": times[lo:].tolist(),
+            "series": {
+                name: [None if math.isnan(v) else round(v, 3) for v in self._ordered(self.values[name])[lo:]]
+                for name in metrics
+            },
+        }
+
+
+class MetricsStore:
+    """
+    只追加、定长记录的磁盘历史文件，读取时使用 mmap
+    文件头保存指标名列表，每条记录为 时间戳 + 各指标值 (均为 double)，
+    记录按时间递增，范围查询二分定位后只读取需要的那一段。
+    超过保留时长的记录在文件增长到一定比例后通过重写文件压缩掉。
+    """
+
+    MAGIC = b"SYSINFO1"
+    HEADER_SIZE = 4096
+
+    def __init__(self, path, metrics, retention):
+        self.path = path
+        self.metrics = list(metrics)
+        self.retention = retention
+        self.record = struct.Struct("<" + "d" * (len(self.metrics) + 1))
+        self._file = None
+        self._open()
+
+    def _header(self):
+        names = json.dumps(self.metrics).encode("utf-8")
+        header = self.MAGIC + struct.pack("<I", len(names)) + names
+        if len(header) > self.HEADER_SIZE:
+            raise ValueError("Too many metrics for history file header")
+        return header.ljust(self.HEADER_SIZE, b"\0")
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                header = f.read(self.HEADER_SIZE)
+            if header != self._header():
+                # 指标列表变化后旧文件无法按新的记录格式读取，保留一份备份后重新开始
+                print(f"[sysinfo] History file format changed, moving {self.path} aside")
+                os.replace(self.path, self.path + ".old")
+        if not os.path.exists(self.path):
+            with open(self.path, "wb") as f:
+                f.write(self._header())
+        else:
+            # 截掉上次异常退出时可能残留的半条记录
+            size = os.path.getsize(self.path)
+            extra = (size - self.HEADER_SIZE) % self.record.size
+            if extra:
+                with open(self.path, "r+b") as f:
+                    f.truncate(size - extra)
+        self._file = open(self.path, "ab")
+        self._count = (os.path.getsize(self.path) - self.HEADER_SIZE) // self.record.size
+        self._first_time = None
+
+    def close(self):
+        if self._file and not self._file.closed:
+            self._file.close()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, values):
+        self._file.write(self.record.pack(timestamp, *values))
+        self._file.flush()
+        self._count += 1
+        if self._first_time is None:
+            self._first_time = self._read_records(0, 1)[0][0]
+        # 过期数据超过保留时长的 1/4 时压缩
+        if timestamp - self._first_time > self.retention * 1.25:
+            self.compact(timestamp - self.retention)
+
+    @staticmethod
+    def _map(f):
+        """只读映射整个文件"""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read_records(self, start, stop):
+        if stop <= start:
+            return []
+        with open(self.path, "rb") as f, self._map(f) as mm:
+            begin = self.HEADER_SIZE + start * self.record.size
+            end = self.HEADER_SIZE + stop * self.record.size
+            return list(self.record.iter_unpack(mm[begin:end]))
+
+    def _bisect(self, timestamp):
+        """返回第一条时间戳 >= timestamp 的记录序号"""
+        lo, hi = 0, self._count
+        if not hi:
+            return 0
+        with open(self.path, "rb") as f, self._map(f) as mm:
+            while lo < hi:
+                mid = (lo + hi) // 2
+                (t,) = struct.unpack_from("<d", mm, self.HEADER_SIZE + mid * self.record.size)
+                if t < timestamp:
+                    lo = mid + 1
+                else:
+                    hi = mid
+        return lo
+
+    def tail(self, n):
+        return self._read_records(max(self._count - n, 0), self._count)
+
+    def query(self, metrics, since):
+        self._file.flush()
+        records = self._read_records(self._bisect(since), self._count)
+        indexes = [self.metrics.index(name) + 1 for name in metrics]
+        return {
+            "times": [record[0] for record in records],
+            "series": {
+                name: [None if math.isnan(record[i]) else round(record[i], 3) for record in records]
+                for name, i in zip(metrics, indexes)
+            },
+        }
+
+    def compact(self, since=None):
+        """重写文件，只保留保留时长内的记录"""
+        self._file.flush()
+        start = self._bisect(time.time() - self.retention if since is None else since)
+        tmp_path = self.path + ".tmp"
+        with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+            dst.write(self._header())
+            src.seek(self.HEADER_SIZE + start * self.record.size)
+            while chunk := src.read(1024 * 1024):
+                dst.write(chunk)
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "ab")
+        self._count -= start
+        self._first_time = None
+
+
+class MetricsHistory:
+    """
+    多分辨率的内存历史数据，每次采样增量写入各分辨率的环形缓冲区
+    指定 data_dir 时同时持久化到磁盘，重启后从磁盘恢复缓冲区
+    """
+
+    def __init__(self, resolutions=HISTORY_RESOLUTIONS, data_dir=None, retention=HISTORY_RETENTION):
+        self.metrics = list(HISTORY_METRICS)
+        self.levels = []
+        for step, capacity in resolutions:
+            store = None
+            if data_dir:
+                try:
+                    store = MetricsStore(
+                        os.path.join(data_dir, f"history_{step}s.bin"), self.metrics,
+                        retention.get(step, step * capacity),
+                    )
+                except (OSError, ValueError) as e:
+                    print(f"[sysinfo] History persistence disabled for {step}s resolution: {e}")
+            level = RingSeries(step, capacity, self.metrics, store)
+            if store is not None:
+                level.load(store.tail(capacity))
+            self.levels.append(level)
+
+    def extract(self, info):
+        """从一次采样结果中取出所有历史指标的值"""
+        return {name: extract(info) for name, extract in HISTORY_METRICS.items()}
+
+    def add(self, info):
+        values = self.extract(info)
+        timestamp = time.time()
+        for level in self.levels:
+            level.add(timestamp, values)
+
+    def span(self, level):
+        """该分辨率能提供的最长时长"""
+        span = level.step * level.capacity
+        return max(span, level.store.retention) if level.store is not None else span
+
+    def query(self, metrics, duration):
+        """
+        选择能覆盖所需时长的最精细分辨率，直接切片返回，不做任何重新计算
+        超出内存缓冲区的时长从磁盘文件中读取
+        """
+        level = next((lv for lv in self.levels if self.span(lv) >= duration), self.levels[-1])
+        since = time.time() - duration
+        if level.store is not None and duration > level.step * level.capacity:
+            result = level.store.query(metrics, since)
+        else:
+            result = level.query(metrics, since)
+        result["step"] = level.step
+        return result
+
+    def close(self):
+        for level in self.levels:
+            if level.store is not None:
+                level.store.close()
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def render_metrics(info):
+    """
+    把一次采样结果渲染成 Prometheus 文本格式 (text exposition format 0.0.4)
+    """
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        samples = [(labels, value) for labels, value in samples if value is not None]
+        if not samples:
+            return
+        lines.append(f"# HELP sysinfo_{name} {help_text}")
+        lines.append(f"# TYPE sysinfo_{name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{escape_label(v)}"' for k, v in labels.items())
+            lines.append(f"sysinfo_{name}{{{label_text}}} {value}" if label_text else f"sysinfo_{name} {value}")
+
+    memory, swap, disk = info.get("memory", {}), info.get("swap", {}), info.get("disk", {})
+    disk_io, network = info.get("disk_io", {}), info.get("network", {})
+
+    metric("cpu_usage_percent", "gauge", "Total CPU usage.", [({}, info.get("cpu_usage"))])
+    metric("cpu_core_usage_percent", "gauge", "Per-core CPU usage.",
+           [({"core": i}, v) for i, v in enumerate(info.get("cpu_per_core") or [])])
+    metric("cpu_frequency_mhz", "gauge", "Current CPU frequency.", [({}, info.get("cpu_freq"))])
+    metric("load_average", "gauge", "System load average.",
+           [({"period": period}, v) for period, v in zip(("1m", "5m", "15m"), info.get("load_avg") or ())])
+    metric("memory_bytes", "gauge", "Physical memory.",
+           [({"type": k}, memory.get(k)) for k in ("total", "available", "used", "free")])
+    metric("memory_usage_percent", "gauge", "Physical memory usage.", [({}, memory.get("percent"))])
+    metric("swap_bytes", "gauge", "Swap space.", [({"type": k}, swap.get(k)) for k in ("total", "used", "free")])
+    metric("disk_bytes", "gauge", "Root filesystem space.",
+           [({"mountpoint": "/", "type": k}, disk.get(k)) for k in ("total", "used", "free")])
+    metric("disk_read_bytes_total", "counter", "Bytes read from all disks.", [({}, disk_io.get("read_bytes"))])
+    metric("disk_written_bytes_total", "counter", "Bytes written to all disks.", [({}, disk_io.get("write_bytes"))])
+    metric("disk_reads_total", "counter", "Read operations on all disks.", [({}, disk_io.get("read_count"))])
+    metric("disk_writes_total", "counter", "Write operations on all disks.", [({}, disk_io.get("write_count"))])
+    for field, help_text in (("read_bytes_per_sec", "Disk read throughput."), ("write_bytes_per_sec", "Disk write throughput."),
+                             ("read_iops", "Disk read operations per second."), ("write_iops", "Disk write operations per second."),
+                             ("busy_percent", "Disk busy time.")):
+        metric(f"disk_{field}", "gauge", help_text,
+               [({"device": name}, rates.get(field)) for name, rates in (info.get("disks") or {}).items()])
+    metric("network_receive_bytes_total", "counter", "Bytes received on all interfaces.", [({}, network.get("bytes_recv"))])
+    metric("network_transmit_bytes_total", "counter", "Bytes sent on all interfaces.", [({}, network.get("bytes_sent"))])
+    for field, help_text in (("rx_bytes_per_sec", "Interface receive throughput."), ("tx_bytes_per_sec", "Interface transmit throughput."),
+                             ("rx_packets_per_sec", "Interface packets received per second."), ("tx_packets_per_sec", "Interface packets sent per second.")):
+        metric(f"network_{field}", "gauge", help_text,
+               [({"interface": name}, rates.get(field)) for name, rates in (info.get("nics") or {}).items()])
+    metric("processes", "gauge", "Number of processes.", [({}, info.get("process_count"))])
+    metric("tcp_connections", "gauge", "TCP sockets.",
+           [({"family": "ipv4"}, info.get("tcp4_connection_count")), ({"family": "ipv6"}, info.get("tcp6_connection_count"))])
+    metric("tcp_connections_by_state", "gauge", "TCP sockets by state.",
+           [({"family": "ipv" + kind[3], "state": state}, n)
+            for kind, stats in (info.get("socket_stats") or {}).items() if kind.startswith("tcp")
+            for state, n in stats.get("states", {}).items()])
+    metric("boot_time_seconds", "gauge", "System boot time.", [({}, info.get("boot_time"))])
+
+    services = info.get("services") or {}
+    metric("service_up", "gauge", "Whether the managed service is running.",
+           [({"service": name}, s["running"]) for name, s in services.items()])
+    metric("service_cpu_seconds_total", "counter", "CPU time used by the service process.",
+           [({"service": name}, s.get("cpu_seconds")) for name, s in services.items()])
+    metric("service_memory_rss_bytes", "gauge", "Resident memory of the service process.",
+           [({"service": name}, s.get("rss")) for name, s in services.items()])
+    metric("service_threads", "gauge", "Threads of the service process.",
+           [({"service": name}, s.get("num_threads")) for name, s in services.items()])
+    for metric_name, field, kind, help_text in (
+        ("service_cgroup_cpu_seconds_total", "cpu_seconds", "counter", "CPU time used by the whole service cgroup."),
+        ("service_cgroup_memory_bytes", "memory_current", "gauge", "Memory charged to the service cgroup."),
+        ("service_cgroup_pids", "pids_current", "gauge", "Tasks in the service cgroup."),
+        ("service_cgroup_read_bytes_total", "io_read_bytes", "counter", "Bytes read by the service cgroup."),
+        ("service_cgroup_written_bytes_total", "io_write_bytes", "counter", "Bytes written by the service cgroup."),
+    ):
+        metric(metric_name, kind, help_text,
+               [({"service": name}, (s.get("cgroup") or {}).get(field)) for name, s in services.items()])
+    return "\n".join(lines) + "\n"
+
+
+class SystemInfoCollector:
+    """
+    共享的后台采样器
+    每个 tick 只采样一次，序列化后把同一份 JSON 帧广播给 connected_websockets 中的所有客户端，
+    采样开销不随观看人数增长。
+    各指标分组按自己的间隔刷新，未到期的分组直接复用缓存值。
+    每次采样同时写入历史数据，所以即使没有订阅者也保持采样。
+    """
+
+    def __init__(self, intervals=None):
+        self.intervals = dict(DEFAULT_INTERVALS)
+        self.intervals.update(intervals or {})
+        self.interval = min(self.intervals.values())  # tick 间隔取最短的分组间隔
+        self.static_info = None
+        self.cache = {}          # 各分组最近一次采样的值
+        self.sample_times = {}   # 各分组最近一次采样的时间戳
+        self._next_due = {}      # 各分组下次刷新的 monotonic 时间
+        self.latest = None       # 最近一次采样结果 (dict)
+        self.tick_count = 0      # 采样序号
+        self.group_keys = {}     # 各分组产生的字段名，用于按分组订阅
+        self._frames = {}        # 本 tick 已编码的帧 (mode, encoding) -> frame，每种编码只序列化一次
+        self.history = MetricsHistory(data_dir=HISTORY_DATA_DIR)
+        self.processes = ProcessCache()
+        try:
+            self.alerts = AlertEngine.load(ALERTS_CONFIG)
+        except (OSError, ValueError, TypeError) as e:
+            print(f"[sysinfo] Failed to load alert rules from {ALERTS_CONFIG}: {e}")
+            self.alerts = AlertEngine()
+        self._greenlet = None
+
+    def configure(self, intervals):
+        self.intervals.update(intervals)
+        self.interval = min(self.intervals.values())
+        self._next_due.clear()
+
+    def start(self):
+        if self._greenlet is None or self._greenlet.dead:
+            self._greenlet = gevent.spawn(self._run)
+
+    def stop(self):
+        if self._greenlet is not None:
+            self._greenlet.kill()
+            self._greenlet = None
+
+    def _run(self):
+        self.static_info = get_static_info()
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"[sysinfo] Sampling failed: {e}")
+            gevent.sleep(self.interval)
+
+    def refresh(self):
+        """只刷新到期的指标分组"""
+        now = time.monotonic()
+        for group, sample in METRIC_GROUPS.items():
+            if now < self._next_due.get(group, 0):
+                continue
+            try:
+                result = sample()
+                self.cache.update(result)
+                self.group_keys[group] = tuple(result)
+                self.sample_times[group] = time.time()
+            except Exception as e:
+                print(f"[sysinfo] Sampling group {group} failed: {e}")
+            self._next_due[group] = now + self.intervals[group]
+
+    def refresh_top(self):
+        """有客户端订阅 top 时按间隔刷新进程表"""
+        if not any(handler.top for handler in connected_websockets):
+            return
+        now = time.monotonic()
+        if now < self._next_due.get("top", 0):
+            return
+        self._next_due["top"] = now + self.intervals["top"]
+        try:
+            self.processes.refresh()
+        except Exception as e:
+            print(f"[sysinfo] Sampling top processes failed: {e}")
+
+    def tick(self):
+        self.refresh()
+        self.refresh_top()
+        now = datetime.datetime.now()
+        system_info = dict(self.static_info)
+        system_info.update(self.cache)
+        system_info.update({
+            "sample_times": dict(self.sample_times),
+            "timestamp": int(time.time()),
+            "current_time": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "time_zone": now.astimezone().tzinfo.tzname(None),
+        })
+        self.latest = system_info
+        self.tick_count += 1
+        self._frames = {}
+        self.history.add(system_info)
+        # 先推送再计算告警，告警规则出问题时客户端仍然能收到数据
+        self.broadcast()
+        self.alerts.evaluate(system_info)
+
+    def select(self, info, groups):
+        """只保留订阅的指标分组的字段，groups 为 None 时返回全部"""
+        if groups is None:
+            return info
+        keys = set(ALWAYS_SENT_KEYS)
+        for group in groups:
+            keys.update(self.static_info if group == "static" else self.group_keys.get(group, ()))
+        return {key: value for key, value in info.items() if key in keys}
+
+    def frame(self, mode="full", encoding="json", groups=None, base=None):
+        """
+        返回最近一次采样编码后的帧，相同参数的客户端共用同一份编码结果
+        base 为客户端上次收到的 (tick 序号, 数据)，delta 模式下据此计算差异，
+        这样慢客户端跳过的若干 tick 会合并成一个 delta 帧
+        """
+        if self.latest is None:
+            return None
+        if mode == "delta" and base is None:
+            mode = "full"
+        key = (mode, encoding, groups, base[0] if mode == "delta" else None)
+        if key not in self._frames:
+            data = self.select(self.latest, groups)
+            if mode == "delta":
+                data = diff_frames(self.select(base[1], groups), data)
+            self._frames[key] = encode_frame(data, encoding)
+        return self._frames[key]
+
+    def metrics_text(self):
+        """Prometheus 文本，每个 tick 最多渲染一次"""
+        if self.latest is None:
+            return None
+        if "metrics" not in self._frames:
+            self._frames["metrics"] = render_metrics(self.latest)
+        return self._frames["metrics"]
+
+    def top_frame(self, sort, n, encoding="json"):
+        """返回 top 进程表编码后的帧，相同参数的客户端共用"""
+        if self.processes.updated_at is None:
+            return None
+        key = ("top", sort, n, encoding)
+        if key not in self._frames:
+            self._frames[key] = encode_frame({"top": {
+                "sort": sort,
+                "timestamp": self.processes.updated_at,
+                "processes": self.processes.top(sort, n),
+            }}, encoding)
+        return self._frames[key]
+
+    def broadcast(self):
+        # 只唤醒各客户端自己的发送 greenlet，慢客户端不会阻塞采样器
+        for handler in list(connected_websockets):
+            handler.notify()
+
+
+# 可通过环境变量覆盖采样间隔，例如 SYSINFO_INTERVALS="disk=5,connections=30"
+collector = SystemInfoCollector(parse_intervals(os.environ.get("SYSINFO_INTERVALS")))
+collector.start()
+
+
+def parse_subscription(options):
+    """
+    校验客户端的订阅参数 (来自 URL 参数或 subscribe 消息)，返回规范化后的 dict，不合法时抛出 ValueError
+    groups: 指标分组列表; interval: 最短推送间隔(秒); top / top_sort: top 进程表
+    """
+    subscription = {}
+    if options.get("groups"):
+        groups = options["groups"]
+        groups = groups.split(",") if isinstance(groups, str) else list(groups)
+        unknown = [g for g in groups if g not in FRAME_GROUPS]
+        if unknown:
+            raise ValueError(f"Unknown group: {', '.join(map(str, unknown))}")
+        subscription["groups"] = tuple(sorted(set(groups)))
+    if options.get("interval"):
+        try:
+            subscription["interval"] = max(float(options["interval"]), 0)
+        except (TypeError, ValueError):
+            raise ValueError("interval must be a number")
+    top_sort = options.get("top_sort") or "cpu"
+    if top_sort not in TOP_SORT_KEYS:
+        raise ValueError(f"Unknown top_sort: {top_sort}")
+    if options.get("top"):
+        top = str(options["top"])
+        if not (top.isdecimal() and 0 < int(top) <= TOP_MAX):
+            raise ValueError(f"top must be between 1 and {TOP_MAX}")
+        subscription["top"] = (top_sort, int(top))
+    return subscription
+
+
 class SystemProbeWebSocket:
-    def __init__(self, ws, client_ip):
+    """
+    一个 WebSocket 客户端
+    采样器每个 tick 只调用 notify() 置位唤醒标记，由该客户端自己的发送 greenlet 取最新数据发送。
+    相当于容量为 1、只保留最新一帧的发送队列: 发送阻塞期间错过的 tick 不会堆积，
+    恢复后直接发送最新数据 (delta 模式下合并为一个差异帧)；长时间发不出去的连接会被关闭。
+    """
+
+    def __init__(self, ws, client_ip, mode="full", encoding="json", subscription=None):
         self.ws = ws
         self.client_ip = client_ip
+        self.mode = mode
+        self.encoding = encoding
+        self.base = None     # 上次发送的 (tick 序号, 数据)，delta 模式的差异基准
+        self.groups = None   # 订阅的指标分组，None 表示全部
+        self.interval = 0    # 最短推送间隔，0 表示每个 tick 都推送
+        self.top = None      # 订阅的 top 进程表 (排序字段, 数量)，None 表示不订阅
+        self.top_sent_at = None
+        self.subscribe(subscription or {})
+        self.skipped = 0     # 因发送阻塞或推送间隔而合并掉的 tick 数
+        self.wakeup = gevent.event.Event()
         self.running = True
 
-    def send_system_info(self):
-        try:
-            os_name = platform.system()
-            release = platform.release()
-            version = platform.version()
-            machine = platform.machine()
-            node = platform.node()
+    def subscribe(self, subscription):
+        if "groups" in subscription:
+            self.groups = subscription["groups"]
+            self.base = None  # 分组变化后重新发送一次完整快照
+        if "interval" in subscription:
+            self.interval = subscription["interval"]
+        if "top" in subscription:
+            self.top = subscription["top"]
+            self.top_sent_at = None
 
-            cpu_info = cpuinfo.get_cpu_info()
-            ip_address = socket.gethostbyname(socket.gethostname())
-            bits, linkage = platform.architecture()
+    def notify(self):
+        """由采样器调用，不会阻塞"""
+        if self.wakeup.is_set():
+            self.skipped += 1
+        self.wakeup.set()
 
-            cpu_cores = psutil.cpu_count(logical=False)
-            cpu_threads = psutil.cpu_count(logical=True)
+    def send(self, frame) -> bool:
+        try:
+            with gevent.Timeout(SEND_TIMEOUT):
+                self.ws.send(frame, binary=self.encoding != "json")
+            return True
+        except gevent.Timeout:
+            print(f"[{self.client_ip}] WebSocket send stalled for {SEND_TIMEOUT}s, closing.")
+            return False
+        except (WebSocketError, ConnectionResetError, BrokenPipeError) as e:
+            print(f"[{self.client_ip}] WebSocket closed: {e}")
+            return False
 
-            while self.running:
-                system_info = {
-                    "os": os_name,
-                    "release": release,
-                    "version": version,
-                    "machine": machine,
-                    "processor": cpu_info.get("brand_raw", "Unknown"),
-                    "node": node,
-                    "bits": bits,
-                    "linkage": linkage,
-                    "cpu_usage": psutil.cpu_percent(),
-                    "cpu_freq": psutil.cpu_freq().current if psutil.cpu_freq() else 0,
-                    "cpu_cores": cpu_cores,
-                    "cpu_threads": cpu_threads,
-                    "memory": psutil.virtual_memory()._asdict(),
-                    "swap": psutil.swap_memory()._asdict(),
-                    "disk": psutil.disk_usage("/")._asdict(),
-                    "disk_io": psutil.disk_io_counters()._asdict(),
-                    "network": psutil.net_io_counters()._asdict(),
-                    "load_avg": psutil.getloadavg() if hasattr(psutil, "getloadavg") else (0, 0, 0),
-                    "process_count": len(psutil.pids()),
-                    "boot_time": int(psutil.boot_time()),
-                    "ip_address": ip_address,
-                    "tcp4_connection_count": len(psutil.net_connections(kind="tcp4")),
-                    "tcp6_connection_count": len(psutil.net_connections(kind="tcp6")),
-                    "timestamp": int(time.time()),
-                    "current_time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "time_zone": datetime.datetime.now().astimezone().tzinfo.tzname(None),
-                }
-
-                json_data = json.dumps(system_info)
+    def push(self) -> bool:
+        """发送采样器最近一帧，delta 模式下首帧为完整快照；订阅了 top 时在进程表刷新后追加一帧"""
+        if collector.latest is not None and (self.base is None or self.base[0] != collector.tick_count):
+            frame = collector.frame(self.mode, self.encoding, self.groups, self.base)
+            self.base = (collector.tick_count, collector.latest)
+            if not self.send(frame):
+                return False
+        if self.top and collector.processes.updated_at != self.top_sent_at:
+            top_frame = collector.top_frame(*self.top, self.encoding)
+            if top_frame is not None:
+                self.top_sent_at = collector.processes.updated_at
+                return self.send(top_frame)
+        return True
 
-                try:
-                    self.ws.send(json_data)
-                except (WebSocketError, ConnectionResetError, BrokenPipeError) as e:
-                    print(f"[{self.client_ip}] WebSocket closed: {e}")
+    def _send_loop(self):
+        try:
+            while self.running:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                if not self.running or not self.push():
                     break
+                if self.interval:
+                    gevent.sleep(self.interval)
+        finally:
+            self.close()
 
-                gevent.sleep(1)
+    def _handle_message(self, message):
+        """处理客户端消息: {"subscribe": {"groups": ["cpu", "memory"], "interval": 5, "top": 10, "top_sort": "rss"}}"""
+        try:
+            self.subscribe(parse_subscription(json.loads(message)["subscribe"]))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.send(json.dumps({"error": f"Invalid message: {e}"}))
+            return
+        self.notify()
 
+    def serve(self):
+        """注册到广播列表，并阻塞到客户端断开"""
+        connected_websockets.add(self)
+        collector.start()
+        gevent.spawn(self._send_loop)
+        # 新连接立即拿到最近一帧，不必等下一个 tick
+        self.notify()
+        try:
+            while self.running and not self.ws.closed:
+                message = self.ws.receive()
+                if message is None:
+                    break
+                self._handle_message(message)
+        except (WebSocketError, ConnectionResetError, BrokenPipeError):
+            pass
         finally:
             # 确保清理工作
             self.close()
 
     def close(self):
-        if self.ws in connected_websockets:
-            connected_websockets.remove(self.ws)
+        if not self.running:
+            return
+        self.running = False
+        connected_websockets.discard(self)
+        self.wakeup.set()  # 让发送 greenlet 退出
         if not self.ws.closed:
             try:
                 self.ws.close()
             except Exception:
                 pass
-        self.running = False
         print(f"[{self.client_ip}] Connection cleaned up.")
 
 
@@ -107,13 +1018,70 @@ def handle_websocket():
     client_ip = request.environ.get("REMOTE_ADDR")
     print(f"New WebSocket connection from client: {client_ip}")
 
-    connected_websockets.add(wsock)
-    ws_handler = SystemProbeWebSocket(wsock, client_ip)
+    # ?mode=delta 只推送变化的字段; ?encoding=msgpack 使用二进制帧;
+    # ?groups=cpu,memory&interval=5 只订阅部分指标分组; ?top=20&top_sort=rss 订阅 top 进程表
+    mode = request.query.mode or "full"
+    encoding = request.query.encoding or "json"
+    error = None
+    subscription = None
+    if mode not in FRAME_MODES:
+        error = f"Unknown mode: {mode}"
+    elif encoding not in FRAME_ENCODINGS:
+        error = f"Unknown encoding: {encoding}"
+    elif encoding == "msgpack" and msgpack is None:
+        error = "msgpack encoding requires the msgpack package"
+    else:
+        try:
+            subscription = parse_subscription(request.query)
+        except ValueError as e:
+            error = str(e)
+    if error:
+        wsock.send(json.dumps({"error": error}))
+        wsock.close()
+        return
+
+    SystemProbeWebSocket(wsock, client_ip, mode, encoding, subscription).serve()
 
+
+@app.route("/history")
+def history():
+    """
+    /history?metric=cpu_usage,memory_percent&range=6h
+    返回指定时长内的历史曲线，不传 metric 时返回可用的指标和分辨率
+    """
+    response.content_type = "application/json"
+    if not request.query.metric:
+        return json.dumps({
+            "metrics": collector.history.metrics,
+            "resolutions": [{"step": lv.step, "span": collector.history.span(lv)} for lv in collector.history.levels],
+        })
+
+    metrics = request.query.metric.split(",")
+    unknown = [m for m in metrics if m not in collector.history.metrics]
+    if unknown:
+        abort(400, f"Unknown metric: {', '.join(unknown)}")
     try:
-        ws_handler.send_system_info()
-    finally:
-        ws_handler.close()
+        duration = parse_duration(request.query.range or "10m")
+    except ValueError as e:
+        abort(400, str(e))
+    return json.dumps(collector.history.query(metrics, duration))
+
+
+@app.route("/alerts")
+def alerts():
+    """各告警规则的当前状态"""
+    response.content_type = "application/json"
+    return json.dumps(collector.alerts.states(), ensure_ascii=False)
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus 抓取端点，直接返回采样器缓存的最新数据"""
+    text = collector.metrics_text()
+    if text is None:
+        abort(503, "No samples collected yet.")
+    response.content_type = "text/plain; version=0.0.4; charset=utf-8"
+    return text
 
 
 @app.route("/")
@@ -128,7 +1096,9 @@ def main():
     parser = argparse.ArgumentParser(description="Run the system probe server.")
     parser.add_argument("--host", "-H", default="0.0.0.0", help="Host to listen on (default: 0.0.0.0)")
     parser.add_argument("--port", "-p", type=int, default=8000, help="Port to listen on (default: 8000)")
+    parser.add_argument("--intervals", "-i", default="", help='Metric group sampling intervals, e.g. "cpu=1,disk=5,connections=30"')
     args = parser.parse_args()
+    collector.configure(parse_intervals(args.intervals))
 
     print(f"🚀 Starting server on {args.host}:{args.port}")
     try:
@@ -137,11 +1107,10 @@ def main():
     except KeyboardInterrupt:
         print("\n🧹 Shutting down server...")
         # 主动关闭所有连接
-        for ws in list(connected_websockets):
-            try:
-                ws.close()
-            except Exception:
-                pass
+        collector.stop()
+        collector.history.close()
+        for handler in list(connected_websockets):
+            handler.close()
         print("✅ Server stopped cleanly.")
 
 
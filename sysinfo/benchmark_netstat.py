@@ -0,0 +1,55 @@
+# 对比 netstat.socket_stats 与 psutil.net_connections 统计连接数的耗时
+# python3 benchmark_netstat.py --sockets 5000 --repeat 5
+import argparse
+import socket
+import timeit
+
+import psutil
+
+import netstat
+
+
+def open_sockets(n):
+    """在回环地址上建立 n 个 TCP 连接，制造一个繁忙的 socket 表"""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1024)
+    sockets = [server]
+    for _ in range(n):
+        client = socket.create_connection(server.getsockname())
+        peer, _ = server.accept()
+        sockets += [client, peer]
+    return sockets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /proc/net parsing against psutil.net_connections.")
+    parser.add_argument("--sockets", "-n", type=int, default=0, help="Extra loopback connections to open (default: 0)")
+    parser.add_argument("--repeat", "-r", type=int, default=5, help="Timing repetitions (default: 5)")
+    args = parser.parse_args()
+
+    if not netstat.is_supported():
+        parser.exit(1, "/proc/net is not available on this platform\n")
+
+    sockets = open_sockets(args.sockets)
+    try:
+        stats = netstat.socket_stats()
+        print(f"tcp4: {stats['tcp4']['total']}  tcp6: {stats['tcp6']['total']}  "
+              f"psutil tcp4: {len(psutil.net_connections(kind='tcp4'))}  psutil tcp6: {len(psutil.net_connections(kind='tcp6'))}")
+
+        cases = {
+            "netstat.socket_stats (tcp+udp, v4+v6)": netstat.socket_stats,
+            "psutil.net_connections (tcp4+tcp6)": lambda: (
+                len(psutil.net_connections(kind="tcp4")), len(psutil.net_connections(kind="tcp6"))
+            ),
+        }
+        for name, fn in cases.items():
+            best = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+            print(f"{name:<40} {best * 1000:9.2f} ms")
+    finally:
+        for s in sockets:
+            s.close()
+
+
+if __name__ == "__main__":
+    main()
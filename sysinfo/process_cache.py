@@ -0,0 +1,96 @@
+"""
+跨采样周期复用 psutil.Process 对象的进程表，用于实时的 top 进程视图
+
+每次刷新只为新出现的 pid 创建 Process 对象，已退出(或 pid 被复用)的进程从缓存中剔除，
+所以 cpu_percent 可以基于上一次刷新计算差值；每个进程的属性在 oneshot() 中一次读取。
+"""
+import heapq
+import time
+
+import psutil
+
+# top 视图支持的排序字段
+TOP_SORT_KEYS = {
+    "cpu": "cpu_percent",
+    "rss": "rss",
+    "io": "io_bytes_per_sec",
+}
+
+
+class ProcessCache:
+    def __init__(self):
+        self.procs = {}        # pid -> psutil.Process
+        self.create_times = {} # pid -> 创建时间，用于识别 pid 复用
+        self._io = {}          # pid -> (累计读写字节数, 采样时间)
+        self.rows = []         # 最近一次刷新的进程信息
+        self.updated_at = None
+
+    def _evict(self, pid):
+        self.procs.pop(pid, None)
+        self.create_times.pop(pid, None)
+        self._io.pop(pid, None)
+
+    def refresh(self):
+        pids = set(psutil.pids())
+        for pid in self.procs.keys() - pids:
+            self._evict(pid)
+
+        now = time.time()
+        rows = []
+        for pid in pids:
+            proc = self.procs.get(pid)
+            if proc is None:
+                try:
+                    proc = self.procs[pid] = psutil.Process(pid)
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+            try:
+                row = self._read(proc, now)
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                self._evict(pid)
+                continue
+            if row is not None:
+                rows.append(row)
+        self.rows = rows
+        self.updated_at = now
+        return rows
+
+    def _read(self, proc, now):
+        pid = proc.pid
+        with proc.oneshot():
+            create_time = proc.create_time()
+            if self.create_times.setdefault(pid, create_time) != create_time:
+                # pid 被新进程复用了，丢弃旧对象，下次刷新重新创建
+                self._evict(pid)
+                return None
+            # 新对象第一次调用返回 0，之后返回与上一次刷新之间的 CPU 占用
+            cpu_percent = proc.cpu_percent(None)
+            memory = proc.memory_info()
+            row = {
+                "pid": pid,
+                "name": proc.name(),
+                "status": proc.status(),
+                "num_threads": proc.num_threads(),
+                "cpu_percent": round(cpu_percent, 1),
+                "rss": memory.rss,
+                "io_bytes_per_sec": 0,
+            }
+            try:
+                row["username"] = proc.username()
+            except (psutil.AccessDenied, KeyError):
+                row["username"] = None
+            try:
+                io = proc.io_counters()
+            except (psutil.AccessDenied, AttributeError):  # 其它用户的进程 / 平台不支持
+                io = None
+        if io is not None:
+            total = io.read_bytes + io.write_bytes
+            prev = self._io.get(pid)
+            if prev and now > prev[1] and total >= prev[0]:
+                row["io_bytes_per_sec"] = round((total - prev[0]) / (now - prev[1]))
+            self._io[pid] = (total, now)
+        return row
+
+    def top(self, sort="cpu", n=10):
+        key = TOP_SORT_KEYS[sort]
+        return heapq.nlargest(n, self.rows, key=lambda row: row[key])